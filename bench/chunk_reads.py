@@ -0,0 +1,83 @@
+# run on the micropython unix port from the repo root:
+#   micropython bench/chunk_reads.py
+# compares the bytes and time per step of the old full buffer read in Sample.get_chunk
+# (readinto a 44100 byte array) with reads sized to the chunk, across the bpm range
+import sys
+sys.path.append("src")
+sys.path.append("src/lib")
+
+import logging
+import os
+import struct
+from time import ticks_us, ticks_diff
+
+import sample
+
+sample.logger.setLevel(logging.WARNING)
+sample.chunk_cache = sample.ChunkCache(0)  # no slots, measure the read itself, not the cache
+
+BENCH_WAV = "/tmp/brkbx_chunk_reads.wav"
+OLD_BUFFER_SIZE = 44100
+BEATS = 8
+REPEATS = 4
+
+
+def write_wav(path, nsamples):
+    data_len = nsamples * sample.BYTES_PER_SAMPLE
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", 36 + data_len) + b"WAVE")
+        f.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample.SAMPLE_RATE,
+                                      sample.SAMPLE_RATE * sample.BYTES_PER_SAMPLE, sample.BYTES_PER_SAMPLE, 16))
+        f.write(b"data" + struct.pack("<I", data_len))
+        f.write(bytearray(data_len))
+
+
+def old_reads(s, buf):
+    total = 0
+    with open(s.name, "rb") as f:
+        for i in range(s.chunks):
+            f.seek(s.wav_offset + i * s.chunk_size)
+            total += f.readinto(buf)
+    return total
+
+
+def new_reads(s, buf):
+    total = 0
+    for i in range(s.chunks):
+        s.get_chunk(i, buf)
+        total += s.chunk_bytes(i)
+    return total
+
+
+def timed(fn, *args):
+    best = None
+    for _ in range(REPEATS):
+        t = ticks_us()
+        result = fn(*args)
+        us = ticks_diff(ticks_us(), t)
+        best = us if best is None else min(best, us)
+    return result, best
+
+
+def main():
+    old_buf = bytearray(OLD_BUFFER_SIZE)
+    print("bpm  chunk  old B/step  new B/step  saved  old us/step  new us/step")
+    old_total = new_total = 0
+    for bpm in range(sample.Sample.BPM_MIN, sample.Sample.BPM_MAX + 1, 10):
+        write_wav(BENCH_WAV, round(BEATS * 60 / bpm * sample.SAMPLE_RATE))
+        s = sample.Sample(BENCH_WAV, 0)
+        buf = sample.voice_buffers.lend()
+        old_bytes, old_us = timed(old_reads, s, old_buf)
+        new_bytes, new_us = timed(new_reads, s, buf)
+        sample.voice_buffers.give_back(buf)
+        sample.file_pool.release(BENCH_WAV)
+        old_total += old_bytes
+        new_total += new_bytes
+        print("{:3d}  {:5d}  {:10d}  {:10d}  {:4.0f}%  {:11d}  {:11d}".format(
+            bpm, s.chunk_size, old_bytes // s.chunks, new_bytes // s.chunks,
+            100 * (1 - new_bytes / old_bytes), old_us // s.chunks, new_us // s.chunks))
+    os.remove(BENCH_WAV)
+    print("total: {} -> {} bytes, {:.0f}% less I/O".format(old_total, new_total, 100 * (1 - new_total / old_total)))
+
+
+main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# runs on computer. compares two bench/dsp_suite.py json results:
+#   python bench/dsp_compare.py baseline.json new.json [--threshold 5]
+# prints the change per case and exits non zero if any case got slower by more than
+# the threshold, so it can gate a change. timings on a busy machine jitter by a few
+# percent, keep the threshold above that.
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict[str, float]:
+    with open(path) as f:
+        return json.load(f)["ns_per_sample"]
+
+
+def compare(baseline: dict[str, float], new: dict[str, float], threshold: float) -> list[str]:
+    """ :returns the cases slower than baseline by more than threshold percent """
+    regressions = []
+    print(f"{'case':28s} {'baseline':>9s} {'new':>9s} {'change':>8s}")
+    for name in sorted(baseline.keys() | new.keys()):
+        if name not in new or name not in baseline:
+            print(f"{name:28s} {'only in ' + ('baseline' if name in baseline else 'new'):>28s}")
+            continue
+        change = (new[name] - baseline[name]) / baseline[name] * 100
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  slower"
+        print(f"{name:28s} {baseline[name]:9.2f} {new[name]:9.2f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two DSP benchmark results in ns per output sample.")
+    parser.add_argument("baseline", help="earlier dsp_suite.py json")
+    parser.add_argument("new", help="dsp_suite.py json to check")
+    parser.add_argument("--threshold", "-t", type=float, default=5.0,
+                        help="percent slowdown counted as a regression (default: %(default)s)")
+    args = parser.parse_args()
+    regressions = compare(load(args.baseline), load(args.new), args.threshold)
+    if regressions:
+        sys.exit(f"{len(regressions)} regressions over {args.threshold}%: {', '.join(regressions)}")
+    print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# run on linux with the unix port from the repo root (make bench-dsp builds the x64
+# module first):
+#   micropython bench/dsp_suite.py [results.json]
+# sweeps native_wav over pitch rate, stretch grain sizes, filter depth and mode,
+# direction and voice count (with and without meters), one axis at a time around a
+# plain 1 voice step, and reports ns per output sample, best of REPEATS. results go to
+# stdout and, as json, to the given file for bench/dsp_compare.py to diff against an
+# earlier run.
+import sys
+sys.path.append("native/native_wav/build/x64")
+
+from array import array
+import json
+import math
+import time
+
+import native_wav
+
+SOURCE_SAMPLES = 3675  # an 8th of a beat at 90 bpm
+REPEATS = 7
+CALLS = 20  # per timing, so one timing is a few ms
+
+SEMITONES = (-12, -7, -1, 0, 1, 7, 12)
+STRETCH = ((SOURCE_SAMPLES, SOURCE_SAMPLES), (441, 441), (441, 882), (220, 880), (1102, 2205), (441, 1764))
+FILTER_DEPTHS = (-1.0, -0.5, 0.0, 0.5, 1.0)
+FILTER_MODES = (("float", native_wav.FILTER_FLOAT), ("fixed", native_wav.FILTER_FIXED))
+DIRECTIONS = (("forward", 1), ("reverse", -1))
+VOICES = (1, 2, 4, 6)
+
+
+def now_ns():
+    return time.time_ns() if hasattr(time, "time_ns") else time.ticks_us() * 1000
+
+
+class Case:
+    """ one voice's write() arguments, or VOICE_PARAMS for mix() """
+
+    def __init__(self, source, grain_in=SOURCE_SAMPLES, grain_out=SOURCE_SAMPLES, semitones=0, depth=0.0,
+                 filter_mode=native_wav.FILTER_FLOAT, direction=1):
+        pitch_rate = 2 ** (semitones / 12)
+        self.source = source
+        self.pitch_rate = pitch_rate
+        self.pitched = round(SOURCE_SAMPLES / pitch_rate) - 1
+        self.grain_in = min(grain_in, self.pitched)
+        self.grain_out = grain_out * self.grain_in // grain_in
+        self.target = self.pitched * self.grain_out // self.grain_in
+        self.depth = depth
+        self.filter_mode = filter_mode
+        self.direction = direction
+        self.interp = native_wav.NEAREST if semitones == 0 else native_wav.LINEAR
+        self.filter_state = bytearray(native_wav.FILTER_STATE)
+
+    def write(self, out):
+        return native_wav.write(out, self.source, self.grain_in, self.grain_out, self.target, self.pitched,
+                                self.pitch_rate, 0.8, self.depth, 0.0, self.filter_state, 0, SOURCE_SAMPLES, 0,
+                                self.interp, self.grain_in // 4, self.filter_mode, 0, 0, self.direction)
+
+    def params(self):
+        return array("f", [self.grain_in, self.grain_out, self.target, self.pitched, self.pitch_rate, 0.8,
+                           self.depth, 0, SOURCE_SAMPLES, 0, self.interp, self.grain_in // 4, self.filter_mode, 0, 0,
+                           self.direction])
+
+
+def best_ns_per_sample(render):
+    best = None
+    for _ in range(REPEATS):
+        t = now_ns()
+        samples = 0
+        for _ in range(CALLS):
+            samples += render() // 2
+        ns = (now_ns() - t) / samples
+        best = ns if best is None else min(best, ns)
+    return best
+
+
+def main():
+    source = array("h", (round(8000 * math.sin(i * 0.0138) + 4000 * math.sin(i * 0.9)) for i in range(SOURCE_SAMPLES)))
+    out = bytearray(2 * 4 * SOURCE_SAMPLES)
+    results = {}
+
+    def run(name, render):
+        results[name] = round(best_ns_per_sample(render), 2)
+        print("{:28s} {:8.2f} ns/sample".format(name, results[name]))
+
+    for semitones in SEMITONES:
+        case = Case(source, semitones=semitones)
+        run("pitch/{:+d}".format(semitones), lambda: case.write(out))
+    for grain_in, grain_out in STRETCH:
+        case = Case(source, grain_in, grain_out)
+        run("stretch/{}x{}".format(grain_in, grain_out), lambda: case.write(out))
+    for mode_name, mode in FILTER_MODES:
+        for depth in FILTER_DEPTHS:
+            case = Case(source, depth=depth, filter_mode=mode)
+            run("filter/{}/{:+.1f}".format(mode_name, depth), lambda: case.write(out))
+    for name, direction in DIRECTIONS:
+        # pitched and stretched, so reading backwards goes through the interpolation and crossfades
+        case = Case(source, 441, 882, semitones=7, direction=direction)
+        run("direction/" + name, lambda: case.write(out))
+    for n in VOICES:
+        # a mix of different work per voice: pitched, stretched and filtered
+        cases = [Case(source, 441, 441 + 220 * (i % 3), semitones=(0, 7, -5)[i % 3], depth=(0.0, -0.5, 0.3)[i % 3])
+                 for i in range(n)]
+        sources = [c.source for c in cases]
+        params = [c.params() for c in cases]
+        states = [c.filter_state for c in cases]
+        limiter = array("f", [1.0, 1.0, 0.0, 0.9, 0.005])
+        run("voices/{}".format(n), lambda: native_wav.mix(out, n, sources, params, states, limiter))
+        meters = array("f", [0] * native_wav.METER_STATE * (n + 1))
+        run("voices/{}/metered".format(n), lambda: native_wav.mix(out, n, sources, params, states, limiter, meters))
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump({
+                "platform": sys.platform,
+                "implementation": "{} {}".format(sys.implementation.name, ".".join(str(v) for v in sys.implementation.version[:3])),
+                "source_samples": SOURCE_SAMPLES,
+                "ns_per_sample": results,
+            }, f)
+        print("wrote", sys.argv[1])
+
+
+main()
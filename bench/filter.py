@@ -0,0 +1,49 @@
+# run on the device after deploying native_wav.mpy (make deploy-native):
+#   mpremote run bench/filter.py
+# or on linux with the unix port and an x64 build (make build-native-x64):
+#   micropython bench/filter.py
+# cycles per output sample of native_wav.write with the float and the fixed point
+# biquad across the filter knob, and the largest difference between their outputs.
+# the rest of write() is the same for both, so the difference in cycles is the filter.
+# ticks_cpu counts core cycles on the teensy, on the unix port the numbers are only relative
+import sys
+sys.path.append("native/native_wav/build/x64")
+
+from array import array
+from time import ticks_cpu, ticks_diff
+import math
+
+import native_wav
+
+SOURCE_SAMPLES = 3675  # an 8th of a beat at 90 bpm
+REPEATS = 8
+MODES = (("float", native_wav.FILTER_FLOAT), ("fixed", native_wav.FILTER_FIXED))
+DEPTHS = (-1.0, -0.5, -0.1, 0.0, 0.1, 0.5, 1.0)
+
+
+def render(out, source, depth, mode, filter_state):
+    return native_wav.write(out, source, SOURCE_SAMPLES, SOURCE_SAMPLES, SOURCE_SAMPLES, SOURCE_SAMPLES, 1.0,
+                            1.0, depth, 0.0, filter_state, 0, SOURCE_SAMPLES, 0, native_wav.NEAREST, 0, mode) // 2
+
+
+def main():
+    source = array("h", (round(8000 * math.sin(i * 0.0138) + 4000 * math.sin(i * 0.9)) for i in range(SOURCE_SAMPLES)))
+    outs = [array("h", [0] * SOURCE_SAMPLES) for _ in MODES]
+    print("depth   " + "  ".join("{:>8s}".format(name) for name, _ in MODES) + "  max diff   (cycles/sample)")
+    for depth in DEPTHS:
+        row = []
+        for (_, mode), out in zip(MODES, outs):
+            best = None
+            for _ in range(REPEATS):
+                # fresh state so every repeat filters the same thing
+                filter_state = bytearray(native_wav.FILTER_STATE)
+                t = ticks_cpu()
+                n = render(out, source, depth, mode, filter_state)
+                cycles = ticks_diff(ticks_cpu(), t)
+                best = cycles if best is None else min(best, cycles)
+            row.append(best / n)
+        diff = max(abs(a - b) for a, b in zip(outs[0], outs[1]))
+        print("{:5.1f}   ".format(depth) + "  ".join("{:8.1f}".format(c) for c in row) + "  {:8d}".format(diff))
+
+
+main()
@@ -0,0 +1,49 @@
+# run on linux with the unix port from the repo root (make limiter-check builds the x64
+# module first), or on the device:
+#   micropython bench/limiter.py
+#   mpremote run bench/limiter.py
+# checks native_wav.mix's limiter where it's weakest, the first tile of a call: a quiet
+# step, then a step opening on a hit. the first tile has no lookahead from the previous
+# call, no sample may still go over the ceiling
+import sys
+sys.path.append("native/native_wav/build/x64")
+
+from array import array
+import math
+
+import native_wav
+
+SAMPLES = 3675
+CEILING = 0.9
+HIT = 32000
+
+
+def params(volume):
+    p = array("f", [0] * native_wav.VOICE_PARAMS)
+    p[0] = p[1] = p[2] = p[3] = SAMPLES
+    p[4] = 1  # pitch rate
+    p[5] = volume
+    p[8] = SAMPLES + 1  # snap end, play the whole chunk
+    p[10] = native_wav.NEAREST
+    return p
+
+
+def main():
+    quiet = array("h", (round(2000 * math.sin(i * 0.05)) for i in range(SAMPLES)))
+    hit = array("h", (round(HIT * math.exp(-i / 400) * math.cos(i * 0.02)) for i in range(SAMPLES)))
+    out = array("h", [0] * SAMPLES)
+    state = [bytearray(native_wav.FILTER_STATE)]
+    limiter = array("f", [1.0, 1.0, 0.0, CEILING, 0.005])
+    failures = 0
+    for name, source in (("quiet", quiet), ("hit", hit), ("hit again", hit)):
+        n = native_wav.mix(out, 1, [source], [params(1.0)], state, limiter) // 2
+        ceiling = round(CEILING * 32767)
+        over = sum(1 for k in range(n) if abs(out[k]) > ceiling)
+        peak = max(abs(out[k]) for k in range(n))
+        print("{:10s} peak {:5d}, {} samples over the {} ceiling".format(name, peak, over, ceiling))
+        failures += over > 0
+    print("limiter: {}".format("FAILED" if failures else "ok"))
+    sys.exit(1 if failures else 0)
+
+
+main()
@@ -0,0 +1,43 @@
+# run on the device after deploying native_wav.mpy (make deploy-native):
+#   mpremote run bench/resample.py
+# cycles per output sample of native_wav.write for each interpolation mode, across
+# the semitone shifts fx.Pitch makes. ticks_cpu counts core cycles on the teensy,
+# on the unix port the numbers are only relative
+from array import array
+from time import ticks_cpu, ticks_diff
+import math
+
+import native_wav
+
+SOURCE_SAMPLES = 3675  # an 8th of a beat at 90 bpm
+REPEATS = 8
+MODES = (("nearest", native_wav.NEAREST), ("linear", native_wav.LINEAR), ("hermite", native_wav.HERMITE))
+SEMITONES = (-12, -7, -1, 1, 7, 12)
+
+
+def render(out, source, mode, pitch_rate, filter_state):
+    pitched = round(SOURCE_SAMPLES / pitch_rate) - 1
+    return native_wav.write(out, source, pitched, pitched, pitched, pitched, pitch_rate,
+                            1.0, 0.0, 0.0, filter_state, 0, SOURCE_SAMPLES, 0, mode) // 2
+
+
+def main():
+    source = array("h", (round(12000 * math.sin(i * 0.05)) for i in range(SOURCE_SAMPLES)))
+    out = bytearray(2 * 2 * SOURCE_SAMPLES)
+    filter_state = bytearray(native_wav.FILTER_STATE)
+    print("semitones  " + "  ".join("{:>8s}".format(name) for name, _ in MODES) + "   (cycles/sample)")
+    for semitones in SEMITONES:
+        pitch_rate = 2 ** (semitones / 12)
+        row = []
+        for _, mode in MODES:
+            best = None
+            for _ in range(REPEATS):
+                t = ticks_cpu()
+                n = render(out, source, mode, pitch_rate, filter_state)
+                cycles = ticks_diff(ticks_cpu(), t)
+                best = cycles if best is None else min(best, cycles)
+            row.append(best / n)
+        print("{:9d}  ".format(semitones) + "  ".join("{:8.1f}".format(c) for c in row))
+
+
+main()
@@ -0,0 +1,112 @@
+# run on the micropython unix port from the repo root:
+#   micropython bench/voices.py
+# compares the per step cost of the set based ActiveVoices that sample.py used to
+# have with the current slot table: get()/any() as play_step and prepare_step call
+# them, plus add/remove churn, in us and heap bytes per step
+import sys
+sys.path.append("src")
+sys.path.append("src/lib")
+
+import gc
+import logging
+from time import ticks_us, ticks_diff
+
+import sample
+
+sample.logger.setLevel(logging.WARNING)
+
+STEPS = 2000
+REPEATS = 4
+
+
+class OldActiveVoices:
+    FREE = (None, None)
+
+    def __init__(self):
+        self.voices = [self.FREE] * sample.MAX_VOICES
+
+    def add(self, s, key):
+        for i, v in enumerate(self.voices):
+            if v == self.FREE:
+                break
+        self.voices[i] = (s, key)
+
+    def remove(self, key):
+        for i, pair in enumerate(self.voices):
+            if key == pair[1]:
+                self.voices[i] = self.FREE
+
+    def get(self):
+        return set([s for s, _ in self.voices if s is not None])
+
+    def any(self):
+        return len(self.get()) > 0
+
+
+class FakeSample:
+    def __init__(self, i):
+        self.name = "/bench/{}.wav".format(i)
+
+
+def one_step(voices):
+    # play_step checks any(), prepare_step and read_ahead each walk get()
+    if voices.any():
+        n = 0
+        for _ in voices.get():
+            n += 1
+        for _ in voices.get():
+            n += 1
+        return n
+    return 0
+
+
+def steady(voices):
+    for _ in range(STEPS):
+        one_step(voices)
+
+
+def churn(voices, fakes):
+    # 8 keys with up to 7 held, so the 6 voices overflow and get stolen from
+    for step in range(STEPS):
+        key = step // 2 % 8
+        if step & 1:
+            voices.remove((key + 1) % 8)
+        else:
+            voices.add(fakes[key % len(fakes)], key)
+        one_step(voices)
+
+
+def measure(fn, *args):
+    best_us = best_bytes = None
+    for _ in range(REPEATS):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        t = ticks_us()
+        fn(*args)
+        us = ticks_diff(ticks_us(), t)
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        best_us = us if best_us is None else min(best_us, us)
+        best_bytes = allocated if best_bytes is None else min(best_bytes, allocated)
+    return best_us / STEPS, best_bytes / STEPS
+
+
+def main():
+    fakes = [FakeSample(i) for i in range(sample.MAX_VOICES)]
+    print("case                 old us  new us  old B/step  new B/step")
+    for held in (1, 3, sample.MAX_VOICES):
+        old, new = OldActiveVoices(), sample.ActiveVoices()
+        for key in range(held):
+            old.add(fakes[key], key)
+            new.add(fakes[key], key)
+        (old_us, old_b), (new_us, new_b) = measure(steady, old), measure(steady, new)
+        print("steady {} voices      {:6.1f}  {:6.1f}  {:10.0f}  {:10.0f}".format(held, old_us, new_us, old_b, new_b))
+    for policy, name in ((sample.STEAL_OLDEST, "oldest"), (sample.STEAL_QUIETEST, "quietest"),
+                         (sample.STEAL_SAME_SAMPLE, "same-sample")):
+        (old_us, old_b), (new_us, new_b) = (measure(churn, OldActiveVoices(), fakes),
+                                            measure(churn, sample.ActiveVoices(policy), fakes))
+        print("churn {:12s}   {:6.1f}  {:6.1f}  {:10.0f}  {:10.0f}".format(name, old_us, new_us, old_b, new_b))
+
+
+main()
@@ -0,0 +1,284 @@
+// Include the header file to get access to the MicroPython API
+#include "py/dynruntime.h"
+#include "../native_wav/dsp.h"
+
+// Insert effects run on the mixed output, in chain order, one tile at a time: a tile of
+// audio_out_buffer is loaded once, goes through every active effect and is stored once,
+// so an effect costs its own cycles and no extra pass over the buffer.
+//
+// Each effect is an array("f") of EFFECT_PARAMS (kind, wet, then up to three settings
+// of its kind) and a caller owned state bytearray of state_size(kind[, delay_samples])
+// bytes, like native_wav's filter states. wet 0 bypasses the effect. When it's turned
+// back on its history is cleared, so nothing stale from the last time plays.
+enum { FX_BITCRUSH, FX_DELAY, FX_REVERB, FX_RINGMOD, FX_KINDS };
+enum { P_KIND, P_WET, P_A, P_B, P_C, EFFECT_PARAMS };
+
+#define SAMPLE_RATE 44100.0f
+#define TILE_SAMPLES 64
+#define MAX_EFFECTS 8
+
+typedef struct {
+    int active;
+    int pos;
+} Header;
+
+// bitcrush: A = bits kept (1..16), B = downsample factor (>= 1, fractional is fine)
+typedef struct {
+    Header h;
+    float held;
+    float phase;
+} Bitcrush;
+
+static void bitcrush_tile(Bitcrush* s, const float* p, float* x, int n) {
+    float bits = p[P_A] < 1 ? 1 : (p[P_A] > 16 ? 16 : p[P_A]);
+    float factor = p[P_B] < 1 ? 1 : p[P_B];
+    float step = (float)(1 << (16 - (int)bits));
+    float inv_step = 1.0f / step;
+    for (int k = 0; k < n; ++k) {
+        s->phase += 1.0f;
+        if (s->phase >= factor) {
+            s->phase -= factor;
+            s->held = (int32_t)(x[k] * inv_step) * step;
+        }
+        x[k] = s->held;
+    }
+}
+
+// feedback delay: A = delay in samples, B = feedback (0..0.95), C = damping of the
+// repeats (0 bright .. 1 dark). The ring buffer is the rest of the state.
+typedef struct {
+    Header h;
+    float lowpass;
+    int16_t ring[];
+} Delay;
+
+static void delay_tile(Delay* s, int capacity, const float* p, float* x, int n) {
+    int delay = p[P_A] < 1 ? 1 : (p[P_A] > capacity - 1 ? capacity - 1 : p[P_A]);
+    float feedback = p[P_B] < 0 ? 0 : (p[P_B] > 0.95f ? 0.95f : p[P_B]);
+    float damping = p[P_C] < 0 ? 0 : (p[P_C] > 0.99f ? 0.99f : p[P_C]);
+    // the state may have been handed back with a different size
+    if (s->h.pos < 0 || s->h.pos >= capacity)
+        s->h.pos = 0;
+    int read = s->h.pos - delay;
+    if (read < 0)
+        read += capacity;
+    for (int k = 0; k < n; ++k) {
+        float repeat = s->ring[read];
+        s->lowpass += (repeat - s->lowpass) * (1.0f - damping);
+        s->ring[s->h.pos] = dsp_sat16(x[k] + s->lowpass * feedback);
+        x[k] = repeat;
+        if (++s->h.pos == capacity)
+            s->h.pos = 0;
+        if (++read == capacity)
+            read = 0;
+    }
+}
+
+// reverb: mono Freeverb, 4 damped combs in parallel into 2 allpasses in series, with
+// the comb lengths and gains of the original at 44.1k. A = room size (0..1), B = damping
+// (0..1). The rings are float, at Freeverb's input gain int16 rings would hiss and
+// their truncation would keep long tails from decaying cleanly.
+#define COMBS 4
+#define ALLPASSES 2
+static const int comb_lengths[COMBS] = {1116, 1188, 1277, 1356};
+static const int allpass_lengths[ALLPASSES] = {556, 441};
+#define REVERB_RING (1116 + 1188 + 1277 + 1356 + 556 + 441)
+#define REVERB_INPUT_GAIN 0.015f
+#define REVERB_OUTPUT_GAIN 6.0f  // Freeverb's wet gain of 3, doubled for half the combs
+
+typedef struct {
+    Header h;
+    int comb_pos[COMBS];
+    float comb_lowpass[COMBS];
+    int allpass_pos[ALLPASSES];
+    float ring[REVERB_RING];
+} Reverb;
+
+static void reverb_tile(Reverb* s, const float* p, float* x, int n) {
+    float size = p[P_A] < 0 ? 0 : (p[P_A] > 1 ? 1 : p[P_A]);
+    float damping = p[P_B] < 0 ? 0 : (p[P_B] > 1 ? 1 : p[P_B]);
+    float feedback = 0.7f + 0.28f * size;
+    float damp = 0.4f * damping;
+    for (int c = 0; c < COMBS; ++c)
+        if (s->comb_pos[c] < 0 || s->comb_pos[c] >= comb_lengths[c])
+            s->comb_pos[c] = 0;
+    for (int a = 0; a < ALLPASSES; ++a)
+        if (s->allpass_pos[a] < 0 || s->allpass_pos[a] >= allpass_lengths[a])
+            s->allpass_pos[a] = 0;
+    for (int k = 0; k < n; ++k) {
+        float in = x[k] * REVERB_INPUT_GAIN;
+        float out = 0;
+        float* ring = s->ring;
+        for (int c = 0; c < COMBS; ++c) {
+            float y = ring[s->comb_pos[c]];
+            s->comb_lowpass[c] = y * (1.0f - damp) + s->comb_lowpass[c] * damp;
+            ring[s->comb_pos[c]] = in + s->comb_lowpass[c] * feedback;
+            if (++s->comb_pos[c] == comb_lengths[c])
+                s->comb_pos[c] = 0;
+            out += y;
+            ring += comb_lengths[c];
+        }
+        for (int a = 0; a < ALLPASSES; ++a) {
+            float y = ring[s->allpass_pos[a]];
+            ring[s->allpass_pos[a]] = out + y * 0.5f;
+            out = y - out;
+            if (++s->allpass_pos[a] == allpass_lengths[a])
+                s->allpass_pos[a] = 0;
+            ring += allpass_lengths[a];
+        }
+        x[k] = out * REVERB_OUTPUT_GAIN;
+    }
+}
+
+// ring modulator: A = carrier frequency in Hz (0..4000). The carrier is a rotating
+// phasor, renormalized every tile, so there's no table and no trig per sample.
+#define RINGMOD_MAX_HZ 4000.0f
+
+typedef struct {
+    Header h;
+    float cos_phase, sin_phase;
+} RingMod;
+
+static void ringmod_tile(RingMod* s, const float* p, float* x, int n) {
+    float hz = p[P_A] < 0 ? 0 : (p[P_A] > RINGMOD_MAX_HZ ? RINGMOD_MAX_HZ : p[P_A]);
+    // w <= 0.57 rad, Taylor series to w^7 are accurate to 1e-7
+    float w = 2.0f * 3.14159265f * hz / SAMPLE_RATE;
+    float w2 = w * w;
+    float cos_w = 1 - w2 / 2 * (1 - w2 / 12 * (1 - w2 / 30 * (1 - w2 / 56)));
+    float sin_w = w * (1 - w2 / 6 * (1 - w2 / 20 * (1 - w2 / 42)));
+    float norm = 1.5f - 0.5f * (s->cos_phase * s->cos_phase + s->sin_phase * s->sin_phase);
+    float c = s->cos_phase * norm, sn = s->sin_phase * norm;
+    for (int k = 0; k < n; ++k) {
+        x[k] *= sn;
+        float next_c = c * cos_w - sn * sin_w;
+        sn = sn * cos_w + c * sin_w;
+        c = next_c;
+    }
+    s->cos_phase = c;
+    s->sin_phase = sn;
+}
+
+static size_t state_bytes(int kind, int delay_samples) {
+    switch (kind) {
+        case FX_BITCRUSH: return sizeof(Bitcrush);
+        case FX_DELAY: return sizeof(Delay) + delay_samples * sizeof(int16_t);
+        case FX_REVERB: return sizeof(Reverb);
+        case FX_RINGMOD: return sizeof(RingMod);
+    }
+    return 0;
+}
+
+// zero the effect's history when it comes back on. a plain loop, there's no memset
+// to link against in a native module
+static void clear_state(uint8_t* state, size_t len, int kind) {
+    for (size_t i = 0; i < len; ++i)
+        state[i] = 0;
+    if (kind == FX_RINGMOD)
+        ((RingMod*)state)->cos_phase = 1.0f;
+}
+
+typedef struct {
+    const float* params;
+    uint8_t* state;
+    int kind, capacity;
+} Effect;
+
+// process(buf, nbytes, params, states): run the chain over the first nbytes of buf in
+// place. params and states are lists, one entry per effect in chain order.
+// :returns effects that ran
+static mp_obj_t process(size_t n_args, const mp_obj_t* args) {
+    mp_buffer_info_t bufinfo;
+    mp_get_buffer_raise(args[0], &bufinfo, MP_BUFFER_RW);
+    int16_t* buf = (int16_t*)bufinfo.buf;
+    int len = MIN((size_t)mp_obj_get_int(args[1]), bufinfo.len) / sizeof(int16_t);
+    size_t n_params, n_states;
+    mp_obj_t *params, *states;
+    mp_obj_get_array(args[2], &n_params, &params);
+    mp_obj_get_array(args[3], &n_states, &states);
+    if (n_params != n_states || n_params > MAX_EFFECTS)
+        mp_raise_ValueError(MP_ERROR_TEXT("bad effect count"));
+
+    Effect effects[MAX_EFFECTS];
+    int n_effects = 0;
+    for (size_t i = 0; i < n_params; ++i) {
+        mp_buffer_info_t info;
+        mp_get_buffer_raise(params[i], &info, MP_BUFFER_READ);
+        if (info.len < EFFECT_PARAMS * sizeof(float))
+            mp_raise_ValueError(MP_ERROR_TEXT("effect params too short"));
+        const float* p = (const float*)info.buf;
+        int kind = p[P_KIND];
+        mp_get_buffer_raise(states[i], &info, MP_BUFFER_RW);
+        if (kind < 0 || kind >= FX_KINDS || info.len < state_bytes(kind, 2))
+            mp_raise_ValueError(MP_ERROR_TEXT("bad effect state"));
+        Header* h = (Header*)info.buf;
+        if (p[P_WET] <= 0) {
+            h->active = 0;
+            continue;
+        }
+        if (!h->active) {
+            clear_state(info.buf, info.len, kind);
+            h->active = 1;
+        }
+        Effect* e = &effects[n_effects++];
+        e->params = p;
+        e->state = info.buf;
+        e->kind = kind;
+        e->capacity = (info.len - sizeof(Delay)) / sizeof(int16_t);
+    }
+    if (n_effects == 0)
+        return mp_obj_new_int(0);
+
+    float dry[TILE_SAMPLES], x[TILE_SAMPLES];
+    for (int start = 0; start < len; start += TILE_SAMPLES) {
+        int n = MIN(TILE_SAMPLES, len - start);
+        for (int k = 0; k < n; ++k)
+            x[k] = buf[start + k];
+        for (int i = 0; i < n_effects; ++i) {
+            Effect* e = &effects[i];
+            for (int k = 0; k < n; ++k)
+                dry[k] = x[k];
+            switch (e->kind) {
+                case FX_BITCRUSH: bitcrush_tile((Bitcrush*)e->state, e->params, x, n); break;
+                case FX_DELAY: delay_tile((Delay*)e->state, e->capacity, e->params, x, n); break;
+                case FX_REVERB: reverb_tile((Reverb*)e->state, e->params, x, n); break;
+                case FX_RINGMOD: ringmod_tile((RingMod*)e->state, e->params, x, n); break;
+            }
+            float wet = e->params[P_WET] > 1 ? 1 : e->params[P_WET];
+            for (int k = 0; k < n; ++k)
+                x[k] = dry[k] + (x[k] - dry[k]) * wet;
+        }
+        for (int k = 0; k < n; ++k)
+            buf[start + k] = dsp_sat16(x[k]);
+    }
+    return mp_obj_new_int(n_effects);
+}
+static MP_DEFINE_CONST_FUN_OBJ_VAR(process_obj, 4, process);
+
+// state_size(kind[, delay_samples]): bytes of state an effect needs, delays need
+// delay_samples more than the longest delay they'll be set to
+static mp_obj_t state_size(size_t n_args, const mp_obj_t* args) {
+    int kind = mp_obj_get_int(args[0]);
+    int delay_samples = n_args > 1 ? mp_obj_get_int(args[1]) : 0;
+    if (kind < 0 || kind >= FX_KINDS || delay_samples < 0)
+        mp_raise_ValueError(MP_ERROR_TEXT("bad effect"));
+    if (kind == FX_DELAY && delay_samples < 2)
+        delay_samples = 2;
+    return mp_obj_new_int(state_bytes(kind, delay_samples));
+}
+static MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(state_size_obj, 1, 2, state_size);
+
+mp_obj_t mpy_init(mp_obj_fun_bc_t *self, size_t n_args, size_t n_kw, mp_obj_t *args) {
+    // This must be first, it sets up the globals dict and other things
+    MP_DYNRUNTIME_INIT_ENTRY
+
+    mp_store_global(MP_QSTR_process, MP_OBJ_FROM_PTR(&process_obj));
+    mp_store_global(MP_QSTR_state_size, MP_OBJ_FROM_PTR(&state_size_obj));
+    mp_store_global(MP_QSTR_BITCRUSH, MP_OBJ_NEW_SMALL_INT(FX_BITCRUSH));
+    mp_store_global(MP_QSTR_DELAY, MP_OBJ_NEW_SMALL_INT(FX_DELAY));
+    mp_store_global(MP_QSTR_REVERB, MP_OBJ_NEW_SMALL_INT(FX_REVERB));
+    mp_store_global(MP_QSTR_RINGMOD, MP_OBJ_NEW_SMALL_INT(FX_RINGMOD));
+    mp_store_global(MP_QSTR_EFFECT_PARAMS, MP_OBJ_NEW_SMALL_INT(EFFECT_PARAMS));
+
+    // This must be last, it restores the globals dict
+    MP_DYNRUNTIME_INIT_EXIT
+}
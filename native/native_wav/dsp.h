@@ -0,0 +1,102 @@
+// Packed 16 bit kernels for int16 audio buffers. On the Cortex-M7 (armv7emdp builds)
+// two samples go through each SIMD instruction (QADD16, SMULBB/SMULTB, SSAT), or one
+// through a single cycle 32x16 multiply (SMULWB), via the ACLE intrinsics gcc ships in
+// arm_acle.h. Everywhere else, including the x64 build for
+// the unix port, a plain C loop does the same arithmetic. Both give bit identical
+// output, bench/dsp_vectors.py checks either against the same test vectors.
+//
+// Gains are Q2.14: 16384 is unity, products are shifted down arithmetically (rounding
+// towards -inf) and saturated where the result is int16.
+#pragma once
+
+#include <stdint.h>
+
+#if defined(__ARM_FEATURE_DSP) && defined(__ARM_FEATURE_SIMD32)
+#include <arm_acle.h>
+#define DSP_SIMD 1
+#else
+#define DSP_SIMD 0
+#endif
+
+#define DSP_GAIN_BITS 14
+#define DSP_GAIN_ONE (1 << DSP_GAIN_BITS)
+
+static inline int16_t dsp_sat16(int32_t x) {
+    return x > INT16_MAX ? INT16_MAX : (x < INT16_MIN ? INT16_MIN : x);
+}
+
+#if DSP_SIMD
+// two samples as one word. the M7 handles unaligned LDR/STR, and memcpy of 4 bytes
+// compiles to a single one, so buffers only need 2 byte alignment
+static inline int16x2_t dsp_load2(const int16_t* p) {
+    int16x2_t v;
+    __builtin_memcpy(&v, p, sizeof(v));
+    return v;
+}
+
+static inline void dsp_store2(int16_t* p, int16x2_t v) {
+    __builtin_memcpy(p, &v, sizeof(v));
+}
+
+static inline int16x2_t dsp_pack2(int32_t lo, int32_t hi) {
+    return (int16x2_t)((uint32_t)lo & 0xffff) | (int16x2_t)((uint32_t)hi << 16);
+}
+#endif
+
+// out[k] = saturate(in[k]), int32 accumulators down to int16
+static inline void dsp_saturate(int16_t* out, const int32_t* in, int n) {
+    int k = 0;
+#if DSP_SIMD
+    for (; k + 1 < n; k += 2)
+        dsp_store2(out + k, dsp_pack2(__ssat(in[k], 16), __ssat(in[k + 1], 16)));
+#endif
+    for (; k < n; ++k)
+        out[k] = dsp_sat16(in[k]);
+}
+
+// acc[k] = in[k] * gain >> 14, int16 to int32 with a Q2.14 gain, so nothing is lost
+// before the accumulator saturates
+static inline void dsp_gain(int32_t* acc, const int16_t* in, int n, int16_t gain) {
+    int k = 0;
+#if DSP_SIMD
+    for (; k + 1 < n; k += 2) {
+        int16x2_t pair = dsp_load2(in + k);
+        acc[k] = __smulbb(pair, gain) >> DSP_GAIN_BITS;
+        acc[k + 1] = __smultb(pair, gain) >> DSP_GAIN_BITS;
+    }
+#endif
+    for (; k < n; ++k)
+        acc[k] = ((int32_t)in[k] * gain) >> DSP_GAIN_BITS;
+}
+
+// acc[k] = acc[k] * gain >> 14 in place, scaling int32 accumulators by a Q2.14 gain. SMULWB
+// keeps the top 32 bits of a 32x16 product, so acc is shifted up 2 first: acc has to stay
+// within +-2^29, far above what a mix of int16 voices reaches. The C version does the same
+// shift, so both agree even outside that range
+static inline void dsp_scale(int32_t* acc, int n, int16_t gain) {
+    int k = 0;
+#if DSP_SIMD
+    for (; k < n; ++k)
+        acc[k] = __smulwb((int32_t)((uint32_t)acc[k] << 2), gain);
+#endif
+    for (; k < n; ++k)
+        acc[k] = (int32_t)(((int64_t)(int32_t)((uint32_t)acc[k] << 2) * gain) >> 16);
+}
+
+// dest[k] = saturate(dest[k] + src[k]), mixing one int16 buffer into another
+static inline void dsp_add(int16_t* dest, const int16_t* src, int n) {
+    int k = 0;
+#if DSP_SIMD
+    for (; k + 1 < n; k += 2)
+        dsp_store2(dest + k, __qadd16(dsp_load2(dest + k), dsp_load2(src + k)));
+#endif
+    for (; k < n; ++k)
+        dest[k] = dsp_sat16((int32_t)dest[k] + src[k]);
+}
+
+// q14 gain of a float, saturated to the Q2.14 range
+static inline int16_t dsp_gain_q14(float gain) {
+    float scaled = gain * DSP_GAIN_ONE;
+    scaled += scaled < 0 ? -0.5f : 0.5f;
+    return scaled > INT16_MAX ? INT16_MAX : (scaled < INT16_MIN ? INT16_MIN : (int16_t)scaled);
+}
@@ -2,6 +2,7 @@
 #include "py/dynruntime.h"
 #include "py/mpprint.h"
 #include <math.h>
+#include "dsp.h"
 
 // Bhaskara I sin approximation: accurate to 0.17% over [0, π], no trig calls needed.
 static float sin_fast(float x) {
@@ -73,15 +74,366 @@ static float process_sample(BiquadFilter* f, float in) {
     return out;
 }
 
-// Persistent filter state, allocated by Python and passed as a buffer.
-// Layout: [BiquadFilter 36B][last_depth 4B][initialized 4B] = 44 bytes total.
-// initialized==0 on first call (Python bytearray starts zeroed).
+// Integer biquad: the float coefficients quantized to Q2.30, products of coefficients
+// and integer samples summed in 64 bits (SMLAL on the M7) and shifted back. The bits
+// shifted out are fed into the next sample (first order error feedback), which keeps
+// the truncation noise out of the low end. Q2.14 coefficients cost the same per sample
+// but move the poles of the low cutoffs audibly (~11dB SNR against the float path at a
+// 60Hz low pass), Q2.30 stays above 50dB across the depth range.
+#define COEFF_BITS 30
+
+enum { FILTER_FLOAT, FILTER_FIXED };
+#ifndef DEFAULT_FILTER_MODE
+#define DEFAULT_FILTER_MODE FILTER_FLOAT
+#endif
+
+typedef struct {
+    int32_t x1, x2, y1, y2;
+    int32_t error;
+    int32_t a0, a1, a2, b1, b2;
+} FixedBiquad;
+
+static int32_t to_coeff(float c) {
+    float scaled = c * (float)(1 << COEFF_BITS);
+    // float has 24 bits of mantissa, no rounding needed at this scale. INT32_MAX isn't a float, 2^31 is
+    return scaled >= 2147483648.0f ? INT32_MAX : (scaled < -2147483648.0f ? INT32_MIN : (int32_t)scaled);
+}
+
+static void quantize_filter_coeffs(FixedBiquad* q, const BiquadFilter* f) {
+    q->a0 = to_coeff(f->a0);
+    q->a1 = to_coeff(f->a1);
+    q->a2 = to_coeff(f->a2);
+    q->b1 = to_coeff(f->b1);
+    q->b2 = to_coeff(f->b2);
+}
+
+static inline int32_t process_sample_fixed(FixedBiquad* f, int32_t in) {
+    int64_t acc = (int64_t)f->a0 * in + (int64_t)f->a1 * f->x1 + (int64_t)f->a2 * f->x2
+                - (int64_t)f->b1 * f->y1 - (int64_t)f->b2 * f->y2 + f->error;
+    int32_t out = (int32_t)(acc >> COEFF_BITS);
+    f->error = (int32_t)(acc - ((int64_t)out << COEFF_BITS));
+    f->x2 = f->x1; f->x1 = in;
+    f->y2 = f->y1; f->y1 = out;
+    return out;
+}
+
+// Source position is a 16.16 fixed point phase, advanced by a constant step per output
+// sample, so the inner loop never multiplies the index by the pitch rate.
+#define PHASE_BITS 16
+#define PHASE_ONE (1 << PHASE_BITS)
+#define PHASE_MASK (PHASE_ONE - 1)
+
+enum { INTERP_NEAREST, INTERP_LINEAR, INTERP_HERMITE };
+
+static inline int32_t source_at(const int16_t* src, int n, int j) {
+    return src[j < 0 ? 0 : (j >= n ? n - 1 : j)];
+}
+
+// Sample n long source at a fixed point phase. Positions past either end repeat the edge sample.
+static inline float interpolate(const int16_t* src, int n, uint32_t phase, int mode) {
+    int j = phase >> PHASE_BITS;
+    if (mode == INTERP_NEAREST)
+        return source_at(src, n, j);
+    int32_t frac = phase & PHASE_MASK;
+    int32_t y0 = source_at(src, n, j);
+    int32_t y1 = source_at(src, n, j + 1);
+    if (mode == INTERP_LINEAR)
+        return y0 + (((y1 - y0) * (frac >> 1)) >> (PHASE_BITS - 1));  // 15 bit frac keeps the product in int32
+    // 4-point, 3rd order Hermite (Catmull-Rom)
+    float ym1 = source_at(src, n, j - 1);
+    float y2 = source_at(src, n, j + 2);
+    float t = frac * (1.0f / PHASE_ONE);
+    float c1 = 0.5f * (y1 - ym1);
+    float c2 = ym1 - 2.5f * y0 + 2.0f * y1 - 0.5f * y2;
+    float c3 = 0.5f * (y2 - ym1) + 1.5f * (y0 - y1);
+    return ((c3 * t + c2) * t + c1) * t + y0;
+}
+
+// Where a voice reads its chunk from. Outside [snap_start, snap_end) the chunk's DC
+// level is held instead of reading the source, see write(). A reversed source is read
+// mirrored, phase 0 at end_phase walking down, so stretch, crossfades and interpolation
+// run unchanged over the same buffer. end_phase is set by voice_init.
+typedef struct {
+    const int16_t* buf;
+    int len;
+    int snap_start, snap_end;
+    float dc;
+    int interp;
+    int reverse;
+    uint32_t end_phase;
+} Source;
+
+static inline float read_source(const Source* src, uint32_t phase) {
+    if (src->reverse) {
+        // before the start of the chunk, where a crossfade tail runs past it
+        if (phase > src->end_phase)
+            return src->dc;
+        phase = src->end_phase - phase;
+    }
+    int j = phase >> PHASE_BITS;
+    if (j < src->snap_start || j >= src->snap_end)
+        return src->dc;
+    return interpolate(src->buf, src->len, phase, src->interp);
+}
+
+// Raised cosine fade in, Q15, for crossfading stretch grains. Index with a
+// WINDOW_BITS.PHASE_BITS fixed point position, the fade out is 1 - window.
+#define WINDOW_BITS 8
+#define WINDOW_SIZE (1 << WINDOW_BITS)
+static const int16_t window[WINDOW_SIZE + 1] = {
+    0, 1, 5, 11, 20, 31, 44, 60, 79, 100, 123, 149,
+    177, 208, 241, 277, 315, 355, 398, 443, 491, 541, 593, 648,
+    705, 765, 827, 891, 958, 1027, 1098, 1171, 1247, 1325, 1406, 1488,
+    1573, 1660, 1749, 1841, 1935, 2030, 2128, 2229, 2331, 2435, 2542, 2650,
+    2761, 2874, 2989, 3105, 3224, 3345, 3468, 3592, 3719, 3847, 3978, 4110,
+    4244, 4380, 4518, 4657, 4799, 4942, 5086, 5233, 5381, 5531, 5682, 5835,
+    5990, 6146, 6304, 6463, 6624, 6786, 6950, 7115, 7281, 7449, 7618, 7789,
+    7961, 8134, 8308, 8484, 8660, 8838, 9017, 9197, 9379, 9561, 9744, 9929,
+    10114, 10300, 10487, 10675, 10864, 11054, 11244, 11436, 11628, 11820, 12014, 12208,
+    12403, 12598, 12794, 12990, 13187, 13385, 13583, 13781, 13980, 14179, 14378, 14578,
+    14778, 14978, 15178, 15379, 15580, 15780, 15981, 16182, 16383, 16585, 16786, 16987,
+    17187, 17388, 17589, 17789, 17989, 18189, 18389, 18588, 18787, 18986, 19184, 19382,
+    19580, 19777, 19973, 20169, 20364, 20559, 20753, 20947, 21139, 21331, 21523, 21713,
+    21903, 22092, 22280, 22467, 22653, 22838, 23023, 23206, 23388, 23570, 23750, 23929,
+    24107, 24283, 24459, 24633, 24806, 24978, 25149, 25318, 25486, 25652, 25817, 25981,
+    26143, 26304, 26463, 26621, 26777, 26932, 27085, 27236, 27386, 27534, 27681, 27825,
+    27968, 28110, 28249, 28387, 28523, 28657, 28789, 28920, 29048, 29175, 29299, 29422,
+    29543, 29662, 29778, 29893, 30006, 30117, 30225, 30332, 30436, 30538, 30639, 30737,
+    30832, 30926, 31018, 31107, 31194, 31279, 31361, 31442, 31520, 31596, 31669, 31740,
+    31809, 31876, 31940, 32002, 32062, 32119, 32174, 32226, 32276, 32324, 32369, 32412,
+    32452, 32490, 32526, 32559, 32590, 32618, 32644, 32667, 32688, 32707, 32723, 32736,
+    32747, 32756, 32762, 32766, 32767,
+};
+
+// Persistent filter state, allocated by Python as a bytearray(FILTER_STATE) and passed
+// as a buffer. initialized==0 on first call (Python bytearray starts zeroed). Both
+// paths keep their coefficients current, the history of the one not in use is cleared
+// when the mode changes.
 typedef struct {
     BiquadFilter filter;
+    FixedBiquad fixed;
     float last_depth;
     int initialized;
+    int mode;
 } FilterState;
 
+static void clear_filter_history(FilterState* fs) {
+    fs->filter.x1 = fs->filter.x2 = fs->filter.y1 = fs->filter.y2 = 0.0f;
+    fs->fixed.x1 = fs->fixed.x2 = fs->fixed.y1 = fs->fixed.y2 = fs->fixed.error = 0;
+}
+
+static void prepare_filter(FilterState* fs, float filter_depth, int mode) {
+    int sign_changed = fs->initialized && ((filter_depth > 0) != (fs->last_depth > 0));
+    if (fs->initialized && mode != fs->mode)
+        clear_filter_history(fs);
+    fs->mode = mode;
+    if (!fs->initialized || fabsf(filter_depth - fs->last_depth) > 0.0001f) {
+        if (sign_changed)
+            clear_filter_history(fs);
+        update_filter_coeffs(&fs->filter, filter_depth, 44100.0f);
+        quantize_filter_coeffs(&fs->fixed, &fs->filter);
+        fs->last_depth = filter_depth;
+        fs->initialized = 1;
+    }
+}
+
+static FilterState* get_filter_state(mp_obj_t obj) {
+    mp_buffer_info_t info;
+    mp_get_buffer_raise(obj, &info, MP_BUFFER_WRITE);
+    if (info.len < sizeof(FilterState))
+        mp_raise_ValueError(MP_ERROR_TEXT("filter state too short"));
+    return (FilterState*)info.buf;
+}
+
+// Level meter, accumulated over a render pass. Samples beyond full scale count as
+// clipped, and are clamped to it for the power. The sum of squares is a float: a uint64
+// would be exact, but converting it takes a libgcc call native modules don't link.
+typedef struct {
+    int32_t peak;
+    int clipped, samples;
+    float sum_squares;
+} MeterSum;
+
+static void meter_clear(MeterSum* m) {
+    m->peak = 0;
+    m->clipped = m->samples = 0;
+    m->sum_squares = 0.0f;
+}
+
+static inline void meter_add(MeterSum* m, int32_t x) {
+    int32_t a = x < 0 ? -x : x;
+    if (a > m->peak)
+        m->peak = a;
+    if (a > INT16_MAX) {
+        ++m->clipped;
+        a = INT16_MAX;
+    }
+    m->sum_squares += (float)a * a;
+}
+
+// One voice playing a chunk: grains of grain_in source samples (in pitched units) each
+// stretched to grain_out output samples by repeating, read at pitch_rate, crossfaded
+// where the read position jumps, then filtered and scaled by volume. Rendered a tile at
+// a time by voice_render so write() and mix() share it.
+typedef struct {
+    Source src;
+    FilterState* fs;
+    int fixed_filter;
+    float volume;
+    int grain_in, grain_out, pitched, target;
+    uint32_t phase_step, phase, grain_phase;
+    int sample_offset, block_size, block_i, grain_i, written;
+    // Optional crossfade in output samples wherever the read position jumps: grain repeats
+    // while stretching and the start of the next grain. The previous pass keeps reading
+    // past its end and fades out under the new one, so each output sample costs at most
+    // two source reads. 0 keeps the hard cuts.
+    int crossfade_samples, crossfade_left;
+    uint32_t tail_phase, window_phase, window_step;
+    // Declick ramps over the first and/or last fade_samples of the voice's output, where
+    // it starts from or stops into silence or a jump (DECLICK_IN / DECLICK_OUT flags).
+    // Samples from fade_in_end up to fade_out_start are rendered without them.
+    int fade_samples, fade_in_end, fade_out_start;
+    uint32_t fade_step;
+    // what the voice adds to the bus is metered here when mix() is given meters, else NULL
+    MeterSum* meter;
+} Voice;
+
+enum { DECLICK_IN = 1, DECLICK_OUT = 2 };
+
+static void voice_begin_crossfade(Voice* v) {
+    if (v->crossfade_samples > 0) {
+        v->tail_phase = v->phase;
+        v->window_phase = 0;
+        v->crossfade_left = v->crossfade_samples;
+    }
+}
+
+static void voice_start_grain(Voice* v) {
+    v->block_size = MIN(v->grain_in, v->pitched - v->sample_offset);
+    uint32_t grain_phase = (uint32_t)v->sample_offset * v->phase_step;
+    // without stretch the previous grain ends where this one starts, nothing to fade
+    if (v->written > 0 && v->phase != grain_phase)
+        voice_begin_crossfade(v);
+    v->phase = v->grain_phase = grain_phase;
+    v->block_i = 0;
+    v->grain_i = 0;
+}
+
+static void voice_init(Voice* v, const Source* src, FilterState* fs, int grain_in, int grain_out, int target,
+                       int pitched, float pitch_rate, float volume, float filter_depth, int filter_mode,
+                       int crossfade_samples) {
+    v->src = *src;
+    prepare_filter(fs, filter_depth, filter_mode);
+    v->fs = fs;
+    v->fixed_filter = filter_mode == FILTER_FIXED;
+    v->volume = volume;
+    v->grain_in = grain_in;
+    v->grain_out = grain_out;
+    v->pitched = pitched;
+    v->target = target;
+    v->phase_step = (uint32_t)(pitch_rate * PHASE_ONE + 0.5f);
+    // the last position the forward walk reads is where the reversed one starts
+    v->src.end_phase = pitched > 0 ? (uint32_t)(pitched - 1) * v->phase_step : 0;
+    v->crossfade_samples = MIN(crossfade_samples, grain_in / 2);
+    v->window_step = v->crossfade_samples > 0 ? ((uint32_t)WINDOW_SIZE << PHASE_BITS) / v->crossfade_samples : 0;
+    v->crossfade_left = 0;
+    v->fade_in_end = 0;
+    v->fade_out_start = INT32_MAX;
+    v->meter = NULL;
+    v->phase = 0;
+    v->written = 0;
+    v->sample_offset = 0;
+    if (pitched > 0)
+        voice_start_grain(v);
+}
+
+static void voice_declick(Voice* v, int flags, int fade_samples) {
+    fade_samples = MIN(fade_samples, v->target / 2);
+    if (fade_samples <= 0)
+        return;
+    v->fade_samples = fade_samples;
+    v->fade_step = ((uint32_t)WINDOW_SIZE << PHASE_BITS) / fade_samples;
+    v->fade_in_end = flags & DECLICK_IN ? fade_samples : 0;
+    v->fade_out_start = flags & DECLICK_OUT ? v->target - fade_samples : INT32_MAX;
+}
+
+// Add up to n samples of the voice into acc, metering them into m unless it's NULL.
+// :returns samples rendered, fewer than n once the voice has finished its chunk
+static int voice_render_span(Voice* v, int32_t* acc, int n, MeterSum* m) {
+    int k = 0;
+    for (; k < n && v->written < v->target && v->sample_offset < v->pitched; ++k) {
+        if (v->grain_i == v->grain_out) {
+            v->sample_offset += v->grain_in;
+            if (v->sample_offset >= v->pitched)
+                break;
+            voice_start_grain(v);
+        }
+        // repeat the grain when stretching
+        if (v->block_i == v->block_size) {
+            v->block_i = 0;
+            voice_begin_crossfade(v);
+            v->phase = v->grain_phase;
+        }
+        float sample = read_source(&v->src, v->phase);
+        if (v->crossfade_left > 0) {
+            float fade_in = window[v->window_phase >> PHASE_BITS] * (1.0f / 32768.0f);
+            sample = sample * fade_in + read_source(&v->src, v->tail_phase) * (1.0f - fade_in);
+            v->tail_phase += v->phase_step;
+            v->window_phase += v->window_step;
+            --v->crossfade_left;
+        }
+        v->phase += v->phase_step;
+        ++v->block_i;
+        ++v->grain_i;
+        ++v->written;
+        int32_t x;
+        if (v->fixed_filter)
+            x = (int32_t)(process_sample_fixed(&v->fs->fixed, (int32_t)sample) * v->volume);
+        else
+            x = (int32_t)(process_sample(&v->fs->filter, sample) * v->volume);
+        if (m)
+            meter_add(m, x);
+        acc[k] += x;
+    }
+    if (m)
+        m->samples += k;
+    return k;
+}
+
+// Output is rendered in tiles of int32 accumulators: voices add into the tile, which is
+// saturated into the output once (dsp_saturate), so memory traffic scales with output
+// length only.
+#define TILE_SAMPLES 64
+
+// voice_render_span, with the declick ramps on the few tiles that overlap them. The check
+// is per tile, so the samples in between cost nothing extra. Meters are summed in the
+// span itself, except on ramp tiles where they have to see the faded samples.
+// n <= TILE_SAMPLES
+static int voice_render(Voice* v, int32_t* acc, int n) {
+    int start = v->written;
+    if (start >= v->fade_in_end && start + n <= v->fade_out_start)
+        return voice_render_span(v, acc, n, v->meter);
+    int32_t tile[TILE_SAMPLES];
+    for (int k = 0; k < n; ++k)
+        tile[k] = 0;
+    int rendered = voice_render_span(v, tile, n, NULL);
+    for (int k = 0; k < rendered; ++k) {
+        int i = start + k;
+        int64_t x = tile[k];
+        // the window table is a Q15 fade in, read backwards from the end to fade out
+        if (i < v->fade_in_end)
+            x = x * window[(i * v->fade_step) >> PHASE_BITS] >> 15;
+        if (i >= v->fade_out_start)
+            x = x * window[((v->target - 1 - i) * v->fade_step) >> PHASE_BITS] >> 15;
+        if (v->meter)
+            meter_add(v->meter, x);
+        acc[k] += (int32_t)x;
+    }
+    if (v->meter)
+        v->meter->samples += rendered;
+    return rendered;
+}
+
 static mp_obj_t write(size_t n_args, const mp_obj_t* args) {
     mp_obj_t audio_out = args[0];
     mp_buffer_info_t outbufinfo;
@@ -92,6 +444,7 @@ static mp_obj_t write(size_t n_args, const mp_obj_t* args) {
     mp_buffer_info_t sourcebufinfo;
     mp_get_buffer_raise(source_samples, &sourcebufinfo, MP_BUFFER_READ);
     const int16_t *source_buf = (const int16_t*) sourcebufinfo.buf;
+    int source_len = sourcebufinfo.len / sizeof(int16_t);
 
     mp_int_t stretch_block_input_samples = mp_obj_get_int(args[2]);
     mp_int_t stretch_block_output_samples = mp_obj_get_int(args[3]);
@@ -102,54 +455,315 @@ static mp_obj_t write(size_t n_args, const mp_obj_t* args) {
     mp_float_t filter_depth = mp_obj_get_float(args[8]);
     mp_float_t mix_depth = mp_obj_get_float(args[9]);
 
-    mp_buffer_info_t fsbuf;
-    mp_get_buffer_raise(args[10], &fsbuf, MP_BUFFER_WRITE);
-    FilterState* fs = (FilterState*)fsbuf.buf;
+    FilterState* fs = get_filter_state(args[10]);
 
-    // int interpellation_window = 10;
+    // Optional snap bounds in source samples. Outside [snap_start, snap_end) the chunk's
+    // DC level is held instead, so a grain entered or left on a jump starts and ends at
+    // a zero crossing. Precomputed per chunk by scripts/analyze_samples.py.
+    Source src = {
+        .buf = source_buf,
+        .len = source_len,
+        .snap_start = n_args > 11 ? mp_obj_get_int(args[11]) : 0,
+        .snap_end = n_args > 12 ? mp_obj_get_int(args[12]) : pitched_samples * pitch_rate + 1,
+        .dc = n_args > 13 ? mp_obj_get_int(args[13]) : 0,
+        .interp = n_args > 14 ? mp_obj_get_int(args[14]) : INTERP_NEAREST,
+    };
+    int crossfade_samples = n_args > 15 ? mp_obj_get_int(args[15]) : 0;
+    // FILTER_FLOAT or FILTER_FIXED, DEFAULT_FILTER_MODE is set at build time
+    int filter_mode = n_args > 16 ? mp_obj_get_int(args[16]) : DEFAULT_FILTER_MODE;
+    // DECLICK_IN | DECLICK_OUT and the ramp length in output samples
+    int declick = n_args > 17 ? mp_obj_get_int(args[17]) : 0;
+    int fade_samples = n_args > 18 ? mp_obj_get_int(args[18]) : 0;
+    // playback direction, negative reads the chunk backwards
+    src.reverse = n_args > 19 && mp_obj_get_int(args[19]) < 0;
 
-    int sign_changed = fs->initialized && ((filter_depth > 0) != (fs->last_depth > 0));
-    if (!fs->initialized || fabsf(filter_depth - fs->last_depth) > 0.0001f) {
-        if (sign_changed)
-            fs->filter.x1 = fs->filter.x2 = fs->filter.y1 = fs->filter.y2 = 0.0f;
-        update_filter_coeffs(&fs->filter, filter_depth, 44100.0f);
-        fs->last_depth = filter_depth;
-        fs->initialized = 1;
-    }
+    Voice voice;
+    voice_init(&voice, &src, fs, stretch_block_input_samples, stretch_block_output_samples, target_samples,
+               pitched_samples, pitch_rate, volume, filter_depth, filter_mode, crossfade_samples);
+    voice_declick(&voice, declick, fade_samples);
 
+    // what's already in out is kept at mix_depth, quantized to a Q2.14 gain
+    int16_t mix_gain = dsp_gain_q14(mix_depth);
+    int32_t tile[TILE_SAMPLES];
     int samples_written = 0;
-    for (int sample_offset = 0; sample_offset < pitched_samples; sample_offset += stretch_block_input_samples) {
-        for (int i = 0; i < stretch_block_output_samples; ++i) {
-            int stretch_block_size = MIN(stretch_block_input_samples, pitched_samples - sample_offset);
-            int block_i = i % stretch_block_size;
-
-            float sample;
-            // int block_samples_left = stretch_block_output_samples - i;
-            // if (block_samples_left < interpellation_window && sample_offset + stretch_block_input_samples < pitched_samples) {
-            //     int16_t prev_sample = out_buf[samples_written - 1];
-            //     int next_block_j = pitch_rate * (sample_offset + stretch_block_input_samples);
-            //     int16_t next_block_start_sample = source_buf[next_block_j];
-            //     sample = prev_sample + (next_block_start_sample - prev_sample) / block_samples_left;
-            // } else {
-            int j = pitch_rate * (sample_offset + block_i);
-            sample = source_buf[j];
-            // }
-
-            // Apply filter and volume
-            sample = process_sample(&fs->filter, sample) * volume + mix_depth * out_buf[samples_written];
-            out_buf[samples_written++] = (int16_t)sample;
-            /* mp_printf(&mp_plat_print, "native_wav: block_i = %d, j = %d\n", block_i, j); */
-            if (samples_written == target_samples) {
-                return mp_obj_new_int(2 * samples_written);
-            }
-        }
+    for (;;) {
+        int n = MIN(TILE_SAMPLES, (int)(outbufinfo.len / sizeof(int16_t)) - samples_written);
+        dsp_gain(tile, out_buf + samples_written, n, mix_gain);
+        int rendered = voice_render(&voice, tile, n);
+        dsp_saturate(out_buf + samples_written, tile, rendered);
+        samples_written += rendered;
+        if (rendered < TILE_SAMPLES)
+            break;
     }
-
     return mp_obj_new_int(2 * samples_written);
 }
 // Define a Python reference to the function above
 static MP_DEFINE_CONST_FUN_OBJ_VAR(write_obj, 0, write);
 
+// Per voice parameters for mix(), an array("f") of VOICE_PARAMS per voice
+enum {
+    P_GRAIN_IN, P_GRAIN_OUT, P_TARGET, P_PITCHED, P_PITCH_RATE, P_VOLUME, P_FILTER_DEPTH,
+    P_SNAP_START, P_SNAP_END, P_DC, P_INTERP, P_CROSSFADE, P_FILTER_MODE,
+    P_DECLICK, P_FADE_SAMPLES, P_DIRECTION, VOICE_PARAMS
+};
+#define MAX_MIX_VOICES 8
+
+// Master bus peak limiter, an array("f") of LIMITER_STATE owned by Python. Each tile's
+// gain steps towards what the louder of it and the next tile needs, so the gain is
+// already down when a peak arrives (one tile of lookahead) and the output never exceeds
+// the ceiling. The first tile of a call had no lookahead in the previous call, so if it
+// is over the ceiling its gain drops at once instead of ramping. Steps mostly start on a
+// hit, that's the transient the limiter sees most. Release is a fixed gain step per
+// tile. min_gain and peak are telemetry for Python to read and reset.
+typedef struct {
+    float gain;      // current gain, carried across calls
+    float min_gain;  // lowest gain since Python reset it
+    float peak;      // highest bus level before limiting since reset, 1.0 = full scale
+    float ceiling;   // output ceiling, fraction of full scale
+    float release;   // gain recovered per tile
+} Limiter;
+#define LIMITER_STATE (sizeof(Limiter) / sizeof(float))
+
+static int32_t tile_peak(const int32_t* tile, int n) {
+    int32_t peak = 0;
+    for (int k = 0; k < n; ++k) {
+        int32_t a = tile[k] < 0 ? -tile[k] : tile[k];
+        if (a > peak)
+            peak = a;
+    }
+    return peak;
+}
+
+// Q2.14 limiter gain, rounded down so the gain never lets more through than asked for
+static int16_t limiter_gain_q14(float gain) {
+    return (int16_t)(gain * DSP_GAIN_ONE);
+}
+
+// Scale the tile in place and saturate it into out, both through the dsp.h kernels. The
+// gain moves from start to target in LIMITER_SEGMENTS constant steps rather than per
+// sample: any gain between the two covers this tile's peak, so the steps are as safe as a
+// smooth ramp, and at 1/8 of a tile they're inaudible. The common case, no limiting at
+// all, is only the saturate.
+#define LIMITER_SEGMENTS 8
+
+static void limit_tile(Limiter* l, int32_t* tile, int n, int32_t peak, int32_t next_peak, int first,
+                       int16_t* out) {
+    // one LSB of margin: the gain's >> 14 rounds negative samples away from zero
+    float ceiling = l->ceiling * INT16_MAX - 1.0f;
+    float start = l->gain;
+    if (first && peak * start > ceiling)
+        start = ceiling / peak;
+    int32_t lookahead_peak = MAX(peak, next_peak);
+    float target = lookahead_peak > ceiling ? ceiling / lookahead_peak : 1.0f;
+    if (target > start + l->release)
+        target = start + l->release;
+    int16_t from = limiter_gain_q14(start), to = limiter_gain_q14(target);
+    if (from != to) {
+        for (int i = 0; i < LIMITER_SEGMENTS; ++i) {
+            int begin = n * i / LIMITER_SEGMENTS, end = n * (i + 1) / LIMITER_SEGMENTS;
+            dsp_scale(tile + begin, end - begin, from + (to - from) * (i + 1) / LIMITER_SEGMENTS);
+        }
+    } else if (from != DSP_GAIN_ONE) {
+        dsp_scale(tile, n, from);
+    }
+    dsp_saturate(out, tile, n);
+    l->gain = target;
+    if (MIN(start, target) < l->min_gain)
+        l->min_gain = MIN(start, target);
+    if (peak * (1.0f / INT16_MAX) > l->peak)
+        l->peak = peak * (1.0f / INT16_MAX);
+}
+
+// Per step levels for Python, an array("f") of METER_STATE per meter: the bus first, then
+// one per voice in mix() order. Overwritten by every mix() call.
+typedef struct {
+    float peak;     // highest level, 1.0 = full scale, can go over
+    float power;    // mean square level, full scale squared = 1.0, sqrt for RMS
+    float clipped;  // samples over full scale
+} Meter;
+#define METER_STATE (sizeof(Meter) / sizeof(float))
+
+static void meter_store(const MeterSum* m, Meter* out) {
+    out->peak = m->peak * (1.0f / INT16_MAX);
+    out->power = m->samples > 0 ? m->sum_squares / m->samples * (1.0f / ((float)INT16_MAX * INT16_MAX)) : 0.0f;
+    out->clipped = m->clipped;
+}
+
+// Zero the tile and add n samples of each voice.
+// :returns samples rendered by the longest voice
+static int render_tile(Voice* voices, int n_voices, int32_t* tile, int n) {
+    for (int k = 0; k < n; ++k)
+        tile[k] = 0;
+    int rendered = 0;
+    for (int i = 0; i < n_voices; ++i) {
+        int voice_rendered = voice_render(&voices[i], tile, n);
+        rendered = MAX(rendered, voice_rendered);
+    }
+    return rendered;
+}
+
+// mix(out, n, sources, params, filter_states[, limiter[, meters]]): render the first n
+// voices into out in one pass, replacing its contents. sources are the voices' chunk
+// buffers, params their VOICE_PARAMS float arrays and filter_states their FILTER_STATE
+// byte buffers, as for write(). Voices are summed in int32, then limited if a
+// LIMITER_STATE float array is given (None for no limiter), and saturated once. If
+// meters is given, (n + 1) * METER_STATE floats, the bus before the limiter and each
+// voice are metered on the way.
+// :returns bytes written, the longest voice
+static mp_obj_t mix(size_t n_args, const mp_obj_t* args) {
+    mp_buffer_info_t outbufinfo;
+    mp_get_buffer_raise(args[0], &outbufinfo, MP_BUFFER_WRITE);
+    int16_t *out_buf = (int16_t*) outbufinfo.buf;
+    int out_len = outbufinfo.len / sizeof(int16_t);
+    int n_voices = mp_obj_get_int(args[1]);
+    size_t n_sources, n_params, n_states;
+    mp_obj_t *sources, *params, *states;
+    mp_obj_get_array(args[2], &n_sources, &sources);
+    mp_obj_get_array(args[3], &n_params, &params);
+    mp_obj_get_array(args[4], &n_states, &states);
+    if (n_voices < 0 || n_voices > MAX_MIX_VOICES || (size_t)n_voices > n_sources
+        || (size_t)n_voices > n_params || (size_t)n_voices > n_states) {
+        mp_raise_ValueError(MP_ERROR_TEXT("bad voice count"));
+    }
+    Limiter* limiter = NULL;
+    if (n_args > 5 && args[5] != mp_const_none) {
+        mp_buffer_info_t info;
+        mp_get_buffer_raise(args[5], &info, MP_BUFFER_RW);
+        if (info.len < sizeof(Limiter))
+            mp_raise_ValueError(MP_ERROR_TEXT("limiter state too short"));
+        limiter = (Limiter*)info.buf;
+    }
+    Meter* meters = NULL;
+    MeterSum sums[MAX_MIX_VOICES + 1];
+    if (n_args > 6 && args[6] != mp_const_none) {
+        mp_buffer_info_t info;
+        mp_get_buffer_raise(args[6], &info, MP_BUFFER_RW);
+        if (info.len < (n_voices + 1) * sizeof(Meter))
+            mp_raise_ValueError(MP_ERROR_TEXT("meters too short"));
+        meters = (Meter*)info.buf;
+        for (int i = 0; i <= n_voices; ++i)
+            meter_clear(&sums[i]);
+    }
+
+    Voice voices[MAX_MIX_VOICES];
+    for (int i = 0; i < n_voices; ++i) {
+        mp_buffer_info_t info;
+        mp_get_buffer_raise(params[i], &info, MP_BUFFER_READ);
+        if (info.len < VOICE_PARAMS * sizeof(float))
+            mp_raise_ValueError(MP_ERROR_TEXT("voice params too short"));
+        const float* p = (const float*)info.buf;
+        mp_get_buffer_raise(sources[i], &info, MP_BUFFER_READ);
+        Source src = {
+            .buf = (const int16_t*)info.buf,
+            .len = info.len / sizeof(int16_t),
+            .snap_start = p[P_SNAP_START],
+            .snap_end = p[P_SNAP_END],
+            .dc = p[P_DC],
+            .interp = p[P_INTERP],
+            .reverse = p[P_DIRECTION] < 0,
+        };
+        voice_init(&voices[i], &src, get_filter_state(states[i]), p[P_GRAIN_IN], p[P_GRAIN_OUT], p[P_TARGET],
+                   p[P_PITCHED], p[P_PITCH_RATE], p[P_VOLUME], p[P_FILTER_DEPTH], p[P_FILTER_MODE],
+                   p[P_CROSSFADE]);
+        voice_declick(&voices[i], p[P_DECLICK], p[P_FADE_SAMPLES]);
+        if (meters)
+            voices[i].meter = &sums[1 + i];
+    }
+
+    // two tiles so the limiter can see the next one before writing the current one
+    int32_t tiles[2][TILE_SAMPLES];
+    int current = 0;
+    int samples_written = 0;
+    int rendered = render_tile(voices, n_voices, tiles[current], MIN(TILE_SAMPLES, out_len));
+    int32_t peak = tile_peak(tiles[current], rendered);
+    while (rendered > 0) {
+        int next_n = MIN(TILE_SAMPLES, out_len - samples_written - rendered);
+        int next_rendered = 0;
+        if (rendered == TILE_SAMPLES && next_n > 0)
+            next_rendered = render_tile(voices, n_voices, tiles[current ^ 1], next_n);
+        int32_t next_peak = tile_peak(tiles[current ^ 1], next_rendered);
+        if (meters) {
+            for (int k = 0; k < rendered; ++k)
+                meter_add(&sums[0], tiles[current][k]);
+            sums[0].samples += rendered;
+        }
+        if (limiter) {
+            limit_tile(limiter, tiles[current], rendered, peak, next_peak, samples_written == 0,
+                       out_buf + samples_written);
+        } else {
+            dsp_saturate(out_buf + samples_written, tiles[current], rendered);
+        }
+        samples_written += rendered;
+        rendered = next_rendered;
+        peak = next_peak;
+        current ^= 1;
+    }
+    if (meters) {
+        for (int i = 0; i <= n_voices; ++i)
+            meter_store(&sums[i], &meters[i]);
+    }
+    return mp_obj_new_int(2 * samples_written);
+}
+static MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(mix_obj, 5, 7, mix);
+
+// The dsp.h kernels on whole buffers, for bench/dsp_vectors.py and for Python code
+// that needs to scale or mix int16 buffers without a per sample loop.
+
+// gain(acc, src, gain): acc[k] = src[k] * gain >> 14, acc an array("i"), src int16,
+// gain Q2.14 (16384 is unity)
+// :returns samples processed, the shorter of the two
+static mp_obj_t gain(mp_obj_t acc_obj, mp_obj_t src_obj, mp_obj_t gain_obj) {
+    mp_buffer_info_t acc, src;
+    mp_get_buffer_raise(acc_obj, &acc, MP_BUFFER_WRITE);
+    mp_get_buffer_raise(src_obj, &src, MP_BUFFER_READ);
+    mp_int_t g = mp_obj_get_int(gain_obj);
+    if (g < INT16_MIN || g > INT16_MAX)
+        mp_raise_ValueError(MP_ERROR_TEXT("gain out of Q2.14 range"));
+    int n = MIN(acc.len / sizeof(int32_t), src.len / sizeof(int16_t));
+    dsp_gain((int32_t*)acc.buf, (const int16_t*)src.buf, n, g);
+    return mp_obj_new_int(n);
+}
+static MP_DEFINE_CONST_FUN_OBJ_3(gain_obj, gain);
+
+// scale(acc, gain): acc[k] = acc[k] * gain >> 14 in place, acc an array("i") within
+// +-2^29, gain Q2.14. the limiter's gain stage
+// :returns samples processed
+static mp_obj_t scale(mp_obj_t acc_obj, mp_obj_t gain_obj) {
+    mp_buffer_info_t acc;
+    mp_get_buffer_raise(acc_obj, &acc, MP_BUFFER_RW);
+    mp_int_t g = mp_obj_get_int(gain_obj);
+    if (g < INT16_MIN || g > INT16_MAX)
+        mp_raise_ValueError(MP_ERROR_TEXT("gain out of Q2.14 range"));
+    int n = acc.len / sizeof(int32_t);
+    dsp_scale((int32_t*)acc.buf, n, g);
+    return mp_obj_new_int(n);
+}
+static MP_DEFINE_CONST_FUN_OBJ_2(scale_obj, scale);
+
+// add(dest, src): dest[k] = saturate(dest[k] + src[k]), both int16
+// :returns samples processed, the shorter of the two
+static mp_obj_t add(mp_obj_t dest_obj, mp_obj_t src_obj) {
+    mp_buffer_info_t dest, src;
+    mp_get_buffer_raise(dest_obj, &dest, MP_BUFFER_WRITE);
+    mp_get_buffer_raise(src_obj, &src, MP_BUFFER_READ);
+    int n = MIN(dest.len, src.len) / sizeof(int16_t);
+    dsp_add((int16_t*)dest.buf, (const int16_t*)src.buf, n);
+    return mp_obj_new_int(n);
+}
+static MP_DEFINE_CONST_FUN_OBJ_2(add_obj, add);
+
+// saturate(dest, src): dest[k] = saturate(src[k]), dest int16, src an array("i")
+// :returns samples processed, the shorter of the two
+static mp_obj_t saturate(mp_obj_t dest_obj, mp_obj_t src_obj) {
+    mp_buffer_info_t dest, src;
+    mp_get_buffer_raise(dest_obj, &dest, MP_BUFFER_WRITE);
+    mp_get_buffer_raise(src_obj, &src, MP_BUFFER_READ);
+    int n = MIN(dest.len / sizeof(int16_t), src.len / sizeof(int32_t));
+    dsp_saturate((int16_t*)dest.buf, (const int32_t*)src.buf, n);
+    return mp_obj_new_int(n);
+}
+static MP_DEFINE_CONST_FUN_OBJ_2(saturate_obj, saturate);
+
 // This is the entry point and is called when the module is imported
 mp_obj_t mpy_init(mp_obj_fun_bc_t *self, size_t n_args, size_t n_kw, mp_obj_t *args) {
     // This must be first, it sets up the globals dict and other things
@@ -159,6 +773,24 @@ mp_obj_t mpy_init(mp_obj_fun_bc_t *self, size_t n_args, size_t n_kw, mp_obj_t *a
 
     // Make the function available in the module's namespace
     mp_store_global(MP_QSTR_write, MP_OBJ_FROM_PTR(&write_obj));
+    mp_store_global(MP_QSTR_mix, MP_OBJ_FROM_PTR(&mix_obj));
+    mp_store_global(MP_QSTR_gain, MP_OBJ_FROM_PTR(&gain_obj));
+    mp_store_global(MP_QSTR_scale, MP_OBJ_FROM_PTR(&scale_obj));
+    mp_store_global(MP_QSTR_add, MP_OBJ_FROM_PTR(&add_obj));
+    mp_store_global(MP_QSTR_saturate, MP_OBJ_FROM_PTR(&saturate_obj));
+    mp_store_global(MP_QSTR_SIMD, mp_obj_new_bool(DSP_SIMD));
+    mp_store_global(MP_QSTR_NEAREST, MP_OBJ_NEW_SMALL_INT(INTERP_NEAREST));
+    mp_store_global(MP_QSTR_LINEAR, MP_OBJ_NEW_SMALL_INT(INTERP_LINEAR));
+    mp_store_global(MP_QSTR_HERMITE, MP_OBJ_NEW_SMALL_INT(INTERP_HERMITE));
+    mp_store_global(MP_QSTR_VOICE_PARAMS, MP_OBJ_NEW_SMALL_INT(VOICE_PARAMS));
+    mp_store_global(MP_QSTR_DECLICK_IN, MP_OBJ_NEW_SMALL_INT(DECLICK_IN));
+    mp_store_global(MP_QSTR_DECLICK_OUT, MP_OBJ_NEW_SMALL_INT(DECLICK_OUT));
+    mp_store_global(MP_QSTR_LIMITER_STATE, MP_OBJ_NEW_SMALL_INT(LIMITER_STATE));
+    mp_store_global(MP_QSTR_METER_STATE, MP_OBJ_NEW_SMALL_INT(METER_STATE));
+    mp_store_global(MP_QSTR_FILTER_STATE, MP_OBJ_NEW_SMALL_INT(sizeof(FilterState)));
+    mp_store_global(MP_QSTR_FILTER_FLOAT, MP_OBJ_NEW_SMALL_INT(FILTER_FLOAT));
+    mp_store_global(MP_QSTR_FILTER_FIXED, MP_OBJ_NEW_SMALL_INT(FILTER_FIXED));
+    mp_store_global(MP_QSTR_DEFAULT_FILTER_MODE, MP_OBJ_NEW_SMALL_INT(DEFAULT_FILTER_MODE));
 
     // This must be last, it restores the globals dict
     MP_DYNRUNTIME_INIT_EXIT
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# runs on computer, needs numpy. analyzes samples listed in manifest.json (see
+# build_manifest.py) and adds what's too expensive to work out on the device:
+# - "bpm", "beats", "chunk_size": tempo from autocorrelation of the onset envelope,
+#   replacing the bpm doubling guess, which often lands on the wrong bar count
+# - "slices": chunk boundaries moved onto nearby transients so swung or loosely
+#   played breaks don't get cut through a hit. chunks + 1 sample offsets into the
+#   data chunk, ending with the sample count. pack_bank.py uses them as is, the device
+#   reads them from slices.bin (build_manifest.write_device_manifest) when a sample loads
+# - "snaps": head, tail, dc per chunk, flattened. head/tail are the samples before the
+#   first and after the last zero crossing of the chunk, dc its mean. native_wav holds
+#   dc over them when playback jumps between chunks, so grains start and end clean
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from build_manifest import (BPM_MAX, BPM_MIN, BYTES_PER_SAMPLE, CHANNELS, CHUNKS_PER_BEAT, MANIFEST_NAME,
+                            MAX_CHUNK_SIZE, SAMPLE_RATE, read_manifest, write_manifest)
+
+ANALYSIS_VERSION = 3  # bump to reanalyze every sample on the next run
+
+HOP = 256
+FRAME = 1024
+BAR_BEATS = 4
+BAR_PRIOR = 1.1  # favour whole bars when two beat counts score about the same
+SNAP_FRACTION = 0.25  # how far a boundary may move, as a fraction of a chunk
+ZERO_CROSSING_WINDOW = 128  # samples searched before an onset for a zero crossing
+SNAP_WINDOW = 96  # samples searched at each end of a chunk for a zero crossing, ~2ms
+MIN_SLICE_FRACTION = 0.5  # shortest slice, as a fraction of a chunk
+MAX_SLICE_SAMPLES = MAX_CHUNK_SIZE // BYTES_PER_SAMPLE // CHANNELS  # has to fit a device chunk buffer
+
+
+def read_samples(path: str, offset: int, length: int) -> np.ndarray:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768
+
+
+def onset_strength(x: np.ndarray) -> np.ndarray:
+    """ half wave rectified spectral flux per HOP, log compressed """
+    if len(x) < FRAME:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(x, FRAME)[::HOP] * np.hanning(FRAME)
+    mag = np.log1p(100 * np.abs(np.fft.rfft(frames, axis=1)))
+    flux = np.maximum(np.diff(mag, axis=0), 0).sum(axis=1)
+    return np.concatenate(([0], flux))
+
+
+def pick_onsets(flux: np.ndarray, delta: float = 0.1, median_frames: int = 16) -> np.ndarray:
+    """ local maxima of the onset strength above an adaptive threshold
+    :returns onset positions in samples
+    """
+    if len(flux) < 3:
+        return np.zeros(0, dtype=np.int64)
+    flux = flux / (flux.max() or 1)
+    padded = np.pad(flux, median_frames // 2, mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, median_frames + 1)
+    threshold = np.median(windows, axis=1)[:len(flux)] + delta
+    peaks = (flux[1:-1] > flux[:-2]) & (flux[1:-1] >= flux[2:]) & (flux[1:-1] > threshold[1:-1])
+    return (np.flatnonzero(peaks) + 1) * HOP + FRAME // 2 - HOP
+
+
+def estimate_beats(flux: np.ndarray, nsamples: int) -> tuple[float, int]:
+    """ pick the beat count whose beat period best matches the circular autocorrelation
+    of the onset envelope, the loop repeats so the lags wrap around. scores every beat
+    count in BPM_MIN..BPM_MAX at once, summing the autocorrelation at each beat of the loop
+    :returns (bpm, total_beats)
+    """
+    length = nsamples / SAMPLE_RATE
+    env = flux - flux.mean()
+    spectrum = np.fft.rfft(env)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), n=len(env))
+    acf /= acf[0] or 1
+    candidates = np.arange(math.ceil(BPM_MIN * length / 60), math.floor(BPM_MAX * length / 60) + 1)
+    if not len(candidates):
+        raise ValueError(f"{length:.2f}s is too short for {BPM_MIN}-{BPM_MAX} bpm")
+    beat_index = np.arange(1, candidates.max())
+    lags = len(env) / candidates[:, None] * beat_index[None, :]
+    on_beat = beat_index[None, :] < candidates[:, None]
+    # each lag can fall between frames, interpolate the wrapped autocorrelation
+    values = np.interp(lags, np.arange(len(env) + 1), np.append(acf, acf[0]))
+    scores = (values * on_beat).sum(axis=1) / np.maximum(on_beat.sum(axis=1), 1)
+    scores = np.where(candidates % BAR_BEATS == 0, scores * BAR_PRIOR, scores)
+    beats = int(candidates[np.argmax(scores)])
+    return round(beats / length * 60, 2), beats
+
+
+def zero_crossing_before(x: np.ndarray, position: int) -> int:
+    """ last rising or falling zero crossing in the window before position, or position """
+    start = max(1, position - ZERO_CROSSING_WINDOW)
+    window = x[start - 1:position + 1]
+    crossings = np.flatnonzero(np.signbit(window[:-1]) != np.signbit(window[1:]))
+    return start + int(crossings[-1]) if len(crossings) else position
+
+
+def snap_slices(x: np.ndarray, chunks: int, onsets: np.ndarray) -> list[int]:
+    """ equal chunk grid with each inner boundary moved to the nearest onset within
+    SNAP_FRACTION of a chunk, keeping slices between MIN_SLICE_FRACTION of a chunk and MAX_SLICE_SAMPLES.
+    a boundary that can't snap stays on the grid, clamped so its slice and the ones left
+    after it, the last included, still fit MAX_SLICE_SAMPLES
+    """
+    nsamples = len(x)
+    samples_per_chunk = -(-nsamples // chunks)
+    window = samples_per_chunk * SNAP_FRACTION
+    min_len = samples_per_chunk * MIN_SLICE_FRACTION
+    slices = [0]
+    for k in range(1, chunks):
+        grid = min(k * samples_per_chunk, nsamples)
+        lowest = max(slices[-1] + min_len, nsamples - (chunks - k) * MAX_SLICE_SAMPLES)
+        highest = slices[-1] + MAX_SLICE_SAMPLES
+        boundary = grid
+        if len(onsets):
+            nearest = onsets[np.argmin(np.abs(onsets - grid))]
+            if abs(nearest - grid) <= window:
+                boundary = zero_crossing_before(x, int(nearest))
+        if not lowest <= boundary <= highest:
+            boundary = min(max(grid, math.ceil(lowest)), highest)
+        slices.append(int(min(boundary, nsamples)))
+    slices.append(nsamples)
+    return slices
+
+
+def chunk_snaps(x: np.ndarray, slices: list[int]) -> list[int]:
+    """ :returns head, tail, dc per chunk, flattened. head and tail are 0 when there's
+    no crossing of the dc level within SNAP_WINDOW
+    """
+    pcm = np.round(x * 32768).astype(np.int32)
+    snaps = []
+    for start, end in zip(slices, slices[1:]):
+        chunk = pcm[start:end]
+        dc = int(round(chunk.mean())) if len(chunk) else 0
+        crossings = np.flatnonzero(np.signbit(chunk[:-1] - dc) != np.signbit(chunk[1:] - dc)) + 1
+        head = int(crossings[0]) if len(crossings) and crossings[0] < SNAP_WINDOW else 0
+        tail = len(chunk) - int(crossings[-1]) if len(crossings) and len(chunk) - crossings[-1] < SNAP_WINDOW else 0
+        snaps += (head, tail, max(-32768, min(32767, dc)))
+    return snaps
+
+
+def analyze(path: str, entry: dict) -> dict:
+    """ :returns the fields to add to the manifest entry for path """
+    x = read_samples(path, entry["offset"], entry["length"])
+    flux = onset_strength(x)
+    bpm, beats = estimate_beats(flux, len(x))
+    chunks = CHUNKS_PER_BEAT * beats
+    slices = snap_slices(x, chunks, pick_onsets(flux))
+    return {
+        "analysis": ANALYSIS_VERSION,
+        "bpm": bpm,
+        "beats": beats,
+        "chunk_size": -(-len(x) // chunks) * BYTES_PER_SAMPLE * CHANNELS,
+        "slices": slices,
+        "snaps": chunk_snaps(x, slices),
+    }
+
+
+def _analyze_job(job: tuple[str, dict]) -> dict | str:
+    """ runs in a worker process, errors come back as a message so one bad file doesn't stop the batch """
+    try:
+        return analyze(*job)
+    except (OSError, ValueError) as e:
+        return str(e)
+
+
+def analyze_dir(local_dir: str, *, force: bool = False, jobs: int | None = None, verbose: bool = False) -> None:
+    """ analyze the samples manifest.json in local_dir lists and write the results back.
+    nothing to do if it lists no wavs, e.g. a directory of packed banks
+    :raises FileNotFoundError: no manifest in local_dir
+    """
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        raise FileNotFoundError(f"no manifest in {local_dir}, run build_manifest.py first")
+    samples = read_manifest(manifest_path)
+    if not samples:
+        print("analyzed 0 samples (none in the manifest)")
+        return
+    names = [name for name, entry in samples.items() if force or entry.get("analysis") != ANALYSIS_VERSION]
+    analyzed = 0
+    if names:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            work = [(os.path.join(local_dir, name), samples[name]) for name in names]
+            for name, result in zip(names, pool.map(_analyze_job, work, chunksize=4)):
+                if isinstance(result, str):
+                    print(f"skipping {name}: {result}", file=sys.stderr)
+                    continue
+                if verbose and result["beats"] != samples[name]["beats"]:
+                    print(f"{name}: {samples[name]['beats']} -> {result['beats']} beats, {result['bpm']} bpm")
+                samples[name].update(result)
+                analyzed += 1
+    write_manifest(manifest_path, samples)
+    print(f"analyzed {analyzed} samples ({len(samples) - len(names)} already analyzed)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Add tempo and transient aligned slice tables to manifest.json.")
+    parser.add_argument(
+        "--local",
+        "-l",
+        default=os.environ.get("LOCAL_BREAK_SAMPLE_DIRECTORY"),
+        help="local directory of .wav files (default: $LOCAL_BREAK_SAMPLE_DIRECTORY)",
+    )
+    parser.add_argument("--force", "-f", action="store_true", help="reanalyze samples that already have results")
+    parser.add_argument("--jobs", "-j", type=int, help="worker processes (default: one per cpu)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print samples whose beat count changed")
+    args = parser.parse_args()
+    if not args.local:
+        sys.exit("local directory not set; pass --local or set LOCAL_BREAK_SAMPLE_DIRECTORY in .env")
+    try:
+        analyze_dir(args.local, force=args.force, jobs=args.jobs, verbose=args.verbose)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# runs on computer. precomputes the per-sample metadata that src/sample.py would
+# otherwise work out at boot (wav data offset, bpm guess, chunk size) and writes it
+# to manifest.json next to the samples, so the device loads it in one read.
+# - entries are keyed by file name and carry size/mtime for validation
+# - the device only trusts an entry if the file size still matches
+# - on rebuild, files whose size and mtime are unchanged are not re-parsed, so fields
+#   added by analyze_samples.py survive until the file changes
+# the device gets a slimmer copy (write_device_manifest): the fixed size fields per
+# sample in manifest.json, and the per chunk slices and snaps in slices.bin, which
+# Sample reads for one file at a time when it's loaded
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+SLICE_TABLE_NAME = "slices.bin"
+DEVICE_FIELDS = ("size", "offset", "length", "bpm", "beats", "chunk_size")
+
+# must match src/sample.py
+CHANNELS = 1
+BYTES_PER_SAMPLE = 2
+SAMPLE_RATE = 44100
+CHUNKS_PER_BEAT = 8
+MAX_CHUNK_SIZE = 8192
+BPM_MIN = 90
+BPM_MAX = 180
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def parse_wav(path: str) -> tuple[tuple[int, int, int, int], int, int]:
+    """ :returns ((format tag, channels, sample rate, bits), data_offset, data_length) """
+    fmt = None
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"not a RIFF/WAVE file: {path}")
+        while header := f.read(8):
+            if len(header) < 8:
+                break
+            descriptor, chunk_size = struct.unpack("<4sI", header)
+            if descriptor == b"fmt ":
+                chunk = f.read(chunk_size)
+                tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+                    tag = struct.unpack("<H", chunk[24:26])[0]
+                fmt = (tag, channels, rate, bits)
+                f.seek(chunk_size & 1, os.SEEK_CUR)
+                continue
+            if descriptor == b"data":
+                if fmt is None:
+                    raise ValueError(f"no fmt chunk before data in {path}")
+                return fmt, f.tell(), chunk_size
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    raise ValueError(f"no data chunk in {path}")
+
+
+def is_device_format(fmt: tuple[int, int, int, int]) -> bool:
+    return fmt == (WAVE_FORMAT_PCM, CHANNELS, SAMPLE_RATE, 8 * BYTES_PER_SAMPLE)
+
+
+def find_wav_data(path: str) -> tuple[int, int]:
+    """ :returns (data_offset, data_length) of the wav data chunk, which must be in the device format """
+    fmt, offset, length = parse_wav(path)
+    if not is_device_format(fmt):
+        tag, channels, rate, bits = fmt
+        raise ValueError(f"{path} is format {tag}, {channels} ch, {rate} Hz, {bits} bit; "
+                         f"run scripts/convert_samples.py")
+    return offset, length
+
+
+def guess_beats(nsamples: float) -> tuple[float, int]:
+    """ same guess as Sample._parse on the device: double the beat count from 2 until bpm
+    reaches BPM_MIN. samples too short for 2 beats at BPM_MAX keep the 2 beat guess, with
+    bpm above BPM_MAX
+    :returns (bpm, total_beats)
+    """
+    length = nsamples / SAMPLE_RATE
+    total_beats = 2
+    while True:
+        bpm = round(total_beats / length * 60, 2)
+        if bpm >= BPM_MIN:
+            return bpm, total_beats
+        total_beats *= 2
+
+
+def describe(path: str) -> dict:
+    stat = os.stat(path)
+    offset, length = find_wav_data(path)
+    nsamples = length / CHANNELS / BYTES_PER_SAMPLE
+    bpm, beats = guess_beats(nsamples)
+    samples_per_chunk = math.ceil(nsamples / (CHUNKS_PER_BEAT * beats))
+    return {
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "offset": offset,
+        "length": length,
+        "bpm": bpm,
+        "beats": beats,
+        "chunk_size": samples_per_chunk * BYTES_PER_SAMPLE * CHANNELS,
+    }
+
+
+def read_manifest(path: str) -> dict:
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("samples", {})
+
+
+def write_manifest(path: str, samples: dict) -> None:
+    with open(path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "samples": samples}, f, indent=1, sort_keys=True)
+
+
+def write_device_manifest(samples: dict, out_dir: str) -> tuple[str, str]:
+    """ write the device's manifest.json and slices.bin into out_dir. an analyzed entry
+    gets "table", the byte offset of its chunks + 1 uint32 slices followed by chunks
+    (head, tail, dc) int16 snaps in slices.bin, little endian like the teensy
+    :returns paths of the manifest and the slice table
+    """
+    device = {}
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    table_path = os.path.join(out_dir, SLICE_TABLE_NAME)
+    with open(table_path, "wb") as table:
+        for name, entry in samples.items():
+            device[name] = {field: entry[field] for field in DEVICE_FIELDS}
+            chunks = CHUNKS_PER_BEAT * entry["beats"]
+            slices = entry.get("slices")
+            if not slices or len(slices) != chunks + 1:
+                continue
+            # snaps are measured on the analyzed slices, zeros (no snap) without them
+            snaps = entry.get("snaps")
+            if not snaps or len(snaps) != 3 * chunks:
+                snaps = [0] * (3 * chunks)
+            device[name]["table"] = table.tell()
+            table.write(struct.pack(f"<{chunks + 1}I", *slices))
+            table.write(struct.pack(f"<{3 * chunks}h", *snaps))
+    with open(manifest_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "samples": device}, f, separators=(",", ":"), sort_keys=True)
+    return manifest_path, table_path
+
+
+def build_manifest(local_dir: str, *, verbose: bool = False) -> str:
+    """ write manifest.json into local_dir, reusing entries for unchanged files
+    :returns path of the manifest
+    """
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    previous = read_manifest(manifest_path)
+    samples = {}
+    parsed = 0
+    for name in sorted(os.listdir(local_dir)):
+        path = os.path.join(local_dir, name)
+        if not name.endswith(".wav") or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = previous.get(name)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime") == int(stat.st_mtime):
+            samples[name] = entry
+            continue
+        try:
+            samples[name] = describe(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            continue
+        parsed += 1
+        if verbose:
+            print(f"{name}: {samples[name]['bpm']} bpm, {samples[name]['beats']} beats")
+
+    write_manifest(manifest_path, samples)
+    print(f"manifest: {len(samples)} samples ({parsed} parsed, {len(samples) - parsed} unchanged)")
+    return manifest_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build manifest.json of sample metadata for fast boot.")
+    parser.add_argument(
+        "--local",
+        "-l",
+        default=os.environ.get("LOCAL_BREAK_SAMPLE_DIRECTORY"),
+        help="local directory of .wav files (default: $LOCAL_BREAK_SAMPLE_DIRECTORY)",
+    )
+    parser.add_argument("--verbose", "-v", action="store_true", help="print each parsed sample")
+    args = parser.parse_args()
+    if not args.local:
+        sys.exit("local directory not set; pass --local or set LOCAL_BREAK_SAMPLE_DIRECTORY in .env")
+    if not os.path.isdir(args.local):
+        sys.exit(f"local directory does not exist: {args.local}")
+    build_manifest(args.local, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
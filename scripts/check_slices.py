@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# runs on computer, needs numpy:
+#   python scripts/check_slices.py
+# runs analyze_samples.py's slicing over synthetic breaks across the tempo range, with
+# hits pushed off the grid by up to a third of a chunk, and checks every slice fits a
+# device chunk buffer (MAX_SLICE_SAMPLES) and the slices cover the sample exactly.
+# exits non-zero on any failure
+import sys
+
+import numpy as np
+
+from analyze_samples import CHUNKS_PER_BEAT, MAX_SLICE_SAMPLES, SAMPLE_RATE, onset_strength, pick_onsets, snap_slices
+
+TEMPOS = (90, 92, 100, 120, 140, 174, 180)
+BEATS = (8, 16, 32)
+SEEDS = 4
+
+
+def synthetic_break(bpm: float, beats: int, rng: np.random.Generator) -> np.ndarray:
+    """ decaying noise bursts on a jittered 8th note grid, the hits drifting up to a third
+    of a chunk either side, so some boundaries snap late, some early and some not at all
+    """
+    nsamples = round(beats * 60 / bpm * SAMPLE_RATE)
+    chunk = nsamples / (beats * CHUNKS_PER_BEAT)
+    x = rng.normal(0, 0.002, nsamples).astype(np.float32)
+    decay = np.exp(-np.arange(2048) / 300).astype(np.float32)
+    for k in range(0, beats * CHUNKS_PER_BEAT, CHUNKS_PER_BEAT // 2):
+        at = int(k * chunk + rng.uniform(-1, 1) * chunk / 3)
+        if 0 <= at < nsamples:
+            n = min(len(decay), nsamples - at)
+            x[at:at + n] += rng.normal(0, 0.5, n).astype(np.float32) * decay[:n]
+    return x
+
+
+def main() -> None:
+    failures = 0
+    cases = 0
+    longest = 0
+    for bpm in TEMPOS:
+        for beats in BEATS:
+            for seed in range(SEEDS):
+                x = synthetic_break(bpm, beats, np.random.default_rng(seed))
+                chunks = beats * CHUNKS_PER_BEAT
+                slices = snap_slices(x, chunks, pick_onsets(onset_strength(x)))
+                lengths = np.diff(slices)
+                cases += 1
+                longest = max(longest, int(lengths.max()))
+                if len(slices) != chunks + 1 or slices[0] != 0 or slices[-1] != len(x):
+                    failures += 1
+                    print(f"{bpm} bpm {beats} beats seed {seed}: slices don't cover the sample")
+                elif lengths.max() > MAX_SLICE_SAMPLES or lengths.min() <= 0:
+                    failures += 1
+                    print(f"{bpm} bpm {beats} beats seed {seed}: slice of {lengths.max()} samples, "
+                          f"cap {MAX_SLICE_SAMPLES}, shortest {lengths.min()}")
+    print(f"{cases - failures}/{cases} breaks sliced within {MAX_SLICE_SAMPLES} samples, longest slice {longest}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
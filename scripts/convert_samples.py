@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# runs on computer. converts every audio file in the sample directory to what the
+# device plays (mono 16 bit PCM .wav at 44.1k, see src/sample.py), replacing
+# convert_to_mono.sh:
+# - .wav files already in that format are left alone, only their header is read
+# - PCM/float .wav at 44.1k (any channel count, 8/16/24/32 bit) is converted with numpy,
+#   everything else (other rates, mp3, flac, ...) with ffmpeg
+# - results are cached by sha256 of the source file, so re-syncs only convert files
+#   whose content changed, and files are converted in parallel across cores
+# output is <name>.wav next to the source unless --out is given, a converted .wav
+# replaces its source. when files differ only by extension (foo.wav, foo.mp3) the .wav
+# keeps the name and the others are skipped, never written over it.
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from build_manifest import (BYTES_PER_SAMPLE, CHANNELS, SAMPLE_RATE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+                            is_device_format, parse_wav)
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".aiff", ".aif", ".flac", ".m4a", ".aac", ".ogg")
+CONVERT_VERSION = 1  # part of the cache key, bump when the conversion changes
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "brkbx", "convert")
+
+
+def content_key(path: str) -> str:
+    h = hashlib.sha256(f"v{CONVERT_VERSION}:".encode())
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            h.update(block)
+    return h.hexdigest()
+
+
+def decode_wav(path: str) -> np.ndarray | None:
+    """ :returns float samples (frames, channels) of a 44.1k PCM or float wav,
+    None if it needs ffmpeg
+    """
+    (tag, channels, rate, bits), offset, length = parse_wav(path)
+    if rate != SAMPLE_RATE:
+        return None
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    width = bits // 8
+    data = data[:len(data) // (width * channels) * width * channels]
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        x = np.frombuffer(data, dtype=f"<f{width}").astype(np.float64)
+    elif tag == WAVE_FORMAT_PCM and bits == 8:
+        x = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128) / 128
+    elif tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        x = np.frombuffer(data, dtype=f"<i{width}").astype(np.float64) / 2 ** (bits - 1)
+    elif tag == WAVE_FORMAT_PCM and bits == 24:
+        b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        x = ((b[:, 0] | b[:, 1] << 8 | b[:, 2] << 16) << 8 >> 8).astype(np.float64) / 2 ** 23
+    else:
+        return None
+    return x.reshape(-1, channels)
+
+
+def write_device_wav(path: str, x: np.ndarray) -> None:
+    mono = x.mean(axis=1)
+    pcm = np.clip(np.round(mono * 32768), -32768, 32767).astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(CHANNELS)
+        w.setsampwidth(BYTES_PER_SAMPLE)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+
+
+def ffmpeg_convert(src: str, dest: str) -> None:
+    if shutil.which("ffmpeg") is None:
+        raise OSError("ffmpeg not found in PATH")
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", src,
+                    "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-acodec", "pcm_s16le", dest],
+                   check=True, capture_output=True)
+
+
+def convert_one(src: str, out: str, cache_dir: str) -> str:
+    """ runs in a worker process
+    :returns what was done, for printing
+    """
+    key = content_key(src)
+    cached = os.path.join(cache_dir, key + ".wav")
+    how = "cached"
+    if not os.path.exists(cached):
+        fd, tmp = tempfile.mkstemp(suffix=".wav", dir=cache_dir)
+        os.close(fd)
+        try:
+            x = decode_wav(src) if src.lower().endswith(".wav") else None
+            if x is not None:
+                write_device_wav(tmp, x)
+                how = "converted"
+            else:
+                ffmpeg_convert(src, tmp)
+                how = "converted with ffmpeg"
+            os.replace(tmp, cached)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    # copy via a temp file, out may be src
+    fd, tmp = tempfile.mkstemp(suffix=".wav", dir=os.path.dirname(out))
+    os.close(fd)
+    shutil.copyfile(cached, tmp)
+    os.replace(tmp, out)
+    return how
+
+
+def _convert_job(job: tuple[str, str, str]) -> str:
+    try:
+        return convert_one(*job)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        return f"failed: {e}"
+
+
+def needs_conversion(src: str, out: str) -> bool:
+    if src == out:
+        try:
+            return not is_device_format(parse_wav(src)[0])
+        except (OSError, ValueError):
+            return True
+    return not os.path.exists(out) or os.path.getmtime(out) < os.path.getmtime(src)
+
+
+def convert_dir(local_dir: str, out_dir: str | None = None, *, cache_dir: str = DEFAULT_CACHE_DIR,
+                jobs: int | None = None) -> None:
+    out_dir = out_dir or local_dir
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    work = []
+    up_to_date = 0
+    claimed = {}  # output path -> the source name writing it
+    # .wav sources first, so foo.wav keeps its name and a foo.mp3 next to it can't
+    # overwrite it, in place or in out_dir
+    for name in sorted(os.listdir(local_dir), key=lambda n: (not n.lower().endswith(".wav"), n)):
+        src = os.path.join(local_dir, name)
+        if name.startswith(".") or not name.lower().endswith(AUDIO_EXTENSIONS) or not os.path.isfile(src):
+            continue
+        out = os.path.join(out_dir, os.path.splitext(name)[0] + ".wav")
+        if (owner := claimed.get(out)) is not None:
+            print(f"skipping {name}: {os.path.basename(out)} is already the output of {owner}", file=sys.stderr)
+            continue
+        claimed[out] = name
+        if needs_conversion(src, out):
+            work.append((src, out, cache_dir))
+        else:
+            up_to_date += 1
+    failed = 0
+    if work:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for (src, _, _), how in zip(work, pool.map(_convert_job, work)):
+                print(f"{os.path.basename(src)}: {how}")
+                failed += how.startswith("failed")
+    print(f"done ({len(work) - failed} converted or from cache, {up_to_date} up to date, {failed} failed)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert samples to mono 16 bit 44.1k .wav, with a content hash cache.")
+    parser.add_argument(
+        "--local",
+        "-l",
+        default=os.environ.get("LOCAL_BREAK_SAMPLE_DIRECTORY"),
+        help="local directory of samples (default: $LOCAL_BREAK_SAMPLE_DIRECTORY)",
+    )
+    parser.add_argument("--out", "-o", help="output directory (default: convert in place)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="conversion cache directory (default: %(default)s)")
+    parser.add_argument("--jobs", "-j", type=int, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    if not args.local:
+        sys.exit("local directory not set; pass --local or set LOCAL_BREAK_SAMPLE_DIRECTORY in .env")
+    if not os.path.isdir(args.local):
+        sys.exit(f"local directory does not exist: {args.local}")
+    convert_dir(args.local, args.out, cache_dir=args.cache, jobs=args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,13 @@ import hashlib
 import os
 import subprocess
 import sys
+import tempfile
+
+from analyze_samples import analyze_dir
+from build_manifest import MANIFEST_NAME, SLICE_TABLE_NAME, build_manifest, read_manifest, write_device_manifest
 
 DEFAULT_REMOTE_SAMPLE_DIR = "/flash/samples"
+SAMPLE_EXTENSIONS = (".wav", ".brk")  # .brk from pack_bank.py
 
 MOUNT_CMD = [
     "mpremote",
@@ -43,7 +48,7 @@ def _wav_names_from_stdout(stdout: str) -> set[str]:
     return {
         line.strip()
         for line in stdout.splitlines()
-        if line.strip().endswith(".wav") and not line.strip().startswith(".upload_")
+        if line.strip().endswith(SAMPLE_EXTENSIONS) and not line.strip().startswith(".upload_")
     }
 
 
@@ -61,7 +66,7 @@ def list_remote(remote_dir: str) -> set[str]:
         "import os\n"
         f"remote = {_device_str(remote_dir)}\n"
         "try:\n"
-        "    names = [n for n in os.listdir(remote) if n.endswith('.wav') and not n.startswith('.upload_')]\n"
+        f"    names = [n for n in os.listdir(remote) if any(n.endswith(e) for e in {SAMPLE_EXTENSIONS!r}) and not n.startswith('.upload_')]\n"
         "except OSError:\n"
         "    names = []\n"
         "print('\\n'.join(names))"
@@ -74,7 +79,7 @@ def list_local(local_dir: str) -> set[str]:
     return {
         name
         for name in os.listdir(local_dir)
-        if name.endswith(".wav") and os.path.isfile(os.path.join(local_dir, name))
+        if name.endswith(SAMPLE_EXTENSIONS) and os.path.isfile(os.path.join(local_dir, name))
     }
 
 
@@ -93,7 +98,7 @@ def delete_sample(remote_dir: str, filename: str) -> None:
 
 def _upload_temp_name(filename: str) -> str:
     digest = hashlib.sha256(filename.encode()).hexdigest()[:12]
-    return f".upload_{digest}.wav"
+    return f".upload_{digest}{os.path.splitext(filename)[1]}"
 
 
 def put_sample(local_dir: str, remote_dir: str, filename: str) -> None:
@@ -144,6 +149,13 @@ def sync(local_dir: str, remote_dir: str, *, dry_run: bool = False) -> None:
         print(f"put {filename}")
         put_sample(local_dir, remote_dir, filename)
 
+    manifest_path = build_manifest(local_dir)
+    analyze_dir(local_dir)
+    with tempfile.TemporaryDirectory() as device_dir:
+        device_manifest, slice_table = write_device_manifest(read_manifest(manifest_path), device_dir)
+        run_mpremote("cp", device_manifest, f":{remote_dir}/{MANIFEST_NAME}")
+        run_mpremote("cp", slice_table, f":{remote_dir}/{SLICE_TABLE_NAME}")
+
     if to_delete or to_put:
         print(f"synced {len(local)} local samples ({len(to_delete)} deleted, {len(to_put)} uploaded)")
     else:
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# runs on computer. packs .wav samples into brkbx bank files (.brk) that the device
+# reads with PackedSample in src/sample.py:
+# - header: magic b"BRKB", version, sector size, bpm, beats, chunks, samples per chunk
+# - chunk table: (byte offset, samples) uint32 pair per chunk
+# - snap table (version 2): head, tail, dc int16 per chunk from analyze_samples.py,
+#   zeros if the sample wasn't analyzed
+# - chunks: each starts on a sector boundary and is zero padded to whole sectors,
+#   so playing a step is exactly one aligned read on SD or littlefs
+# all fields little endian. pack into a separate directory and sync that, the device
+# lists .wav and .brk files alike. if manifest.json (build_manifest.py) is present its
+# bpm, beats and slice table (analyze_samples.py) are used instead of equal chunks.
+import argparse
+import os
+import struct
+import sys
+
+from build_manifest import (BYTES_PER_SAMPLE, CHANNELS, CHUNKS_PER_BEAT, MANIFEST_NAME, find_wav_data, guess_beats,
+                            read_manifest)
+
+MAGIC = b"BRKB"
+VERSION = 2
+HEADER = "<4sHHfHHI"
+CHUNK_ENTRY = "<II"
+SNAP_ENTRY = "<hhh"
+SECTOR_SIZE = 512
+PACKED_EXT = ".brk"
+
+
+def align(n: int, sector_size: int) -> int:
+    return (n + sector_size - 1) // sector_size * sector_size
+
+
+def chunk_bounds(nsamples: int, nchunks: int) -> list[tuple[int, int]]:
+    """ equal length chunks as Sample divides them on the device
+    :returns (first sample, samples) per chunk
+    """
+    samples_per_chunk = -(-nsamples // nchunks)
+    return [(i * samples_per_chunk, max(0, min(samples_per_chunk, nsamples - i * samples_per_chunk)))
+            for i in range(nchunks)]
+
+
+def slice_bounds(slices: list[int]) -> list[tuple[int, int]]:
+    """ :returns (first sample, samples) per chunk of a manifest slice table """
+    return [(start, end - start) for start, end in zip(slices, slices[1:])]
+
+
+def pack(wav_path: str, out_path: str, *, sector_size: int = SECTOR_SIZE, meta: dict | None = None) -> None:
+    offset, length = find_wav_data(wav_path)
+    with open(wav_path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    frame = BYTES_PER_SAMPLE * CHANNELS
+    nsamples = len(data) // frame
+    if meta:
+        bpm, beats = meta["bpm"], meta["beats"]
+    else:
+        bpm, beats = guess_beats(nsamples)
+    nchunks = CHUNKS_PER_BEAT * beats
+    # nominal chunk length in the header, the table has the real ones
+    samples_per_chunk = -(-nsamples // nchunks)
+    slices = meta.get("slices") if meta else None
+    snaps = [0, 0, 0] * nchunks
+    if slices and len(slices) == nchunks + 1 and slices[-1] == nsamples:
+        bounds = slice_bounds(slices)
+        # snaps are measured on the analyzed slices, only valid with them
+        if len(meta.get("snaps", ())) == 3 * nchunks:
+            snaps = meta["snaps"]
+    else:
+        bounds = chunk_bounds(nsamples, nchunks)
+
+    table_end = (struct.calcsize(HEADER) + struct.calcsize(CHUNK_ENTRY) * len(bounds)
+                 + struct.calcsize(SNAP_ENTRY) * len(bounds))
+    chunk_offset = align(table_end, sector_size)
+    table = []
+    for _, n in bounds:
+        table.append((chunk_offset, n))
+        chunk_offset += align(n * frame, sector_size)
+
+    with open(out_path, "wb") as out:
+        out.write(struct.pack(HEADER, MAGIC, VERSION, sector_size, bpm, beats, len(bounds), samples_per_chunk))
+        for entry in table:
+            out.write(struct.pack(CHUNK_ENTRY, *entry))
+        for c in range(len(bounds)):
+            out.write(struct.pack(SNAP_ENTRY, *snaps[3 * c:3 * c + 3]))
+        for (first, n), (chunk_offset, _) in zip(bounds, table):
+            out.write(bytes(chunk_offset - out.tell()))
+            out.write(data[first * frame:(first + n) * frame])
+        out.write(bytes(align(out.tell(), sector_size) - out.tell()))
+
+
+def pack_dir(local_dir: str, out_dir: str, *, sector_size: int = SECTOR_SIZE, force: bool = False) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+    manifest_mtime = os.path.getmtime(manifest_path) if manifest else 0
+    packed = skipped = 0
+    for name in sorted(os.listdir(local_dir)):
+        wav_path = os.path.join(local_dir, name)
+        if not name.endswith(".wav") or not os.path.isfile(wav_path):
+            continue
+        out_path = os.path.join(out_dir, os.path.splitext(name)[0] + PACKED_EXT)
+        meta = manifest.get(name)
+        if meta and meta.get("size") != os.path.getsize(wav_path):
+            meta = None
+        source_mtime = max(os.path.getmtime(wav_path), manifest_mtime if meta else 0)
+        if not force and os.path.exists(out_path) and os.path.getmtime(out_path) >= source_mtime:
+            skipped += 1
+            continue
+        try:
+            pack(wav_path, out_path, sector_size=sector_size, meta=meta)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            continue
+        print(f"packed {name}")
+        packed += 1
+    print(f"done ({packed} packed, {skipped} up to date)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pack .wav samples into sector aligned brkbx bank files.")
+    parser.add_argument(
+        "--local",
+        "-l",
+        default=os.environ.get("LOCAL_BREAK_SAMPLE_DIRECTORY"),
+        help="local directory of .wav files (default: $LOCAL_BREAK_SAMPLE_DIRECTORY)",
+    )
+    parser.add_argument("--out", "-o", help="output directory for .brk files (default: <local>/packed)")
+    parser.add_argument("--sector-size", type=int, default=SECTOR_SIZE, help="alignment in bytes (default: %(default)s)")
+    parser.add_argument("--force", "-f", action="store_true", help="repack files that look up to date")
+    args = parser.parse_args()
+    if not args.local:
+        sys.exit("local directory not set; pass --local or set LOCAL_BREAK_SAMPLE_DIRECTORY in .env")
+    if not os.path.isdir(args.local):
+        sys.exit(f"local directory does not exist: {args.local}")
+    pack_dir(args.local, args.out or os.path.join(args.local, "packed"),
+             sector_size=args.sector_size, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
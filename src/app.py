@@ -63,6 +63,7 @@ async def main():
     asyncio.create_task(midi_receive())
     asyncio.create_task(run_internal_clock())
     asyncio.create_task(display.update_display())
+    asyncio.create_task(audio.read_ahead())
     sample.current_sample = sample_knob.value() % len(get_samples())
     until_step = None
     KEY_SCAN_INTERVAL = 0.005
@@ -108,6 +109,7 @@ async def main():
                 internal_clock.bpm = new_bpm
     except (KeyboardInterrupt, Exception) as e:
         print("caught exception {} {}".format(type(e).__name__, e))
+        sample.file_pool.close_all()
         os.umount("/sd")
         sd.deinit()
         audio_out.deinit()
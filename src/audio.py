@@ -1,16 +1,20 @@
 from machine import I2S
 from machine import Pin
 import asyncio
+import math
 import utility
+from array import array
 from time import ticks_us, ticks_diff
 import control
 from control import log_joystick
 from sequence import StepParams
 import native_wav
+from effects import effects_chain
 import fx
 import sample
 from clock import get_running_clock, internal_clock
-from sample import BYTES_PER_SAMPLE, get_current_sample, active_voices
+from midi import LOOKAHEAD_SEC
+from sample import BYTES_PER_SAMPLE, MAX_VOICES, READ_AHEAD_STEPS, get_current_sample, active_voices, chunk_cache, file_pool, voice_buffers
 
 logger = utility.get_logger(__name__)
 
@@ -43,19 +47,52 @@ audio_out = I2S(
 
 swriter = asyncio.StreamWriter(audio_out)
 audio_out_buffer = bytearray(22124)
-filter_states = [bytearray(44) for _ in range(6)]  # one per voice: BiquadFilter(36B) + last_depth(4B) + initialized(4B)
+filter_states = [bytearray(native_wav.FILTER_STATE) for _ in range(MAX_VOICES)]  # one per voice, float and fixed point biquad
+# voices rendered by native_wav.mix this step, packed into the first n slots
+mix_sources = [None] * MAX_VOICES  # chunk memoryviews
+mix_buffers = [None] * MAX_VOICES  # lent from voice_buffers, given back after the mix
+mix_filter_states = [None] * MAX_VOICES
+mix_samples = [None] * MAX_VOICES  # the Sample each voice plays, to hand its level to active_voices
+# grain in, grain out, target, pitched, pitch rate, volume, filter depth, snap start, snap end, dc, interp, crossfade,
+# filter mode, declick flags, declick samples
+voice_params = [array("f", [0] * native_wav.VOICE_PARAMS) for _ in range(MAX_VOICES)]
+# what each voice played last, to tell a continuing chunk from a jump
+voice_last_sample = [None] * MAX_VOICES
+voice_last_step = array("i", [-1] * MAX_VOICES)
+voice_last_chunk = array("i", [-1] * MAX_VOICES)
+voice_last_direction = array("i", [1] * MAX_VOICES)
 audio_out_mv = memoryview(audio_out_buffer)
+SILENCE = memoryview(bytes(512))  # copied over audio_out_buffer for steps with nothing playing
 bytes_written = 0
 target_samples = 0
 stretch_write = 0
 last_input_step = 0
 started_preparing_next_step = False
 PLAY_WINDOW = 2
+CACHE_STATS_INTERVAL = 256  # steps between chunk cache / file pool stat logs
+READ_AHEAD_INTERVAL_MS = 2
+READ_AHEAD_MARGIN_SEC = 0.01  # worst case chunk read, keeps reads out of the prepare window
+RESAMPLE_MODE = native_wav.LINEAR  # for pitched steps, see bench/resample.py for the cost of each mode
+FILTER_MODE = native_wav.DEFAULT_FILTER_MODE  # FILTER_FLOAT or FILTER_FIXED, see bench/filter.py
+STRETCH_CROSSFADE = 0.25  # crossfade at stretch grain repeats, fraction of the grain, 0 for hard cuts
+DECLICK_SAMPLES = 128  # ~3ms ramp where a step starts or stops against silence or a jump
+LIMITER_CEILING = 0.9  # master bus peak, fraction of full scale (about -1dB)
+LIMITER_RELEASE = 0.005  # gain recovered per 64 sample tile, ~150ms from -6dB
+# gain, min gain, peak, ceiling, release. native_wav.mix limits the bus with it and
+# leaves min gain / peak since the last log_limiter_stats() for telemetry
+limiter_state = array("f", [1.0, 1.0, 0.0, LIMITER_CEILING, LIMITER_RELEASE])
+# peak, power (mean square), clipped samples of the bus before the limiter, then of each
+# mixed voice, as of the last native_wav.mix. full scale is 1.0, sqrt(power) is the RMS
+meter_state = array("f", [0] * native_wav.METER_STATE * (1 + MAX_VOICES))
+# loudest step RMS and bus samples over full scale since the last log_meter_stats()
+meter_loudest = 0.0
+meter_clipped = 0
 async def play_step(step, bpm):
     global started_preparing_next_step, last_input_step, stretch_write
     started_preparing_next_step = False
-    do_play_step = sample.active_voices.any() or fx.joystick_mode.has_input()
-    if (len(fx.button_latch.lengths) == 0 and not fx.joystick_mode.gate.is_on(step)) or not do_play_step:
+    # with nothing playing, prepare_step still renders the effects' tails over silence
+    do_play_step = sample.active_voices.any() or fx.joystick_mode.has_input() or effects_chain.any_on()
+    if not fx.gate_open(step) or not do_play_step:
         stretch_write = 0
         return
 
@@ -76,20 +113,122 @@ async def play_step(step, bpm):
 # does this need to be async?
 planned_step_time = None
 async def prepare_step(step, step_time = None) -> None:
+    global bytes_written
     # fx.flip.flip_sample(step)
     await asyncio.sleep_ms(0)  # drain MIDI/clock tasks before blocking
     logger.debug(f"preparing step {step}")
     t0 = ticks_us()
-    for i, sample in enumerate(active_voices.get()):
-        write_channel(step, step_time, sample, i == 0, i)
-        logger.debug(f"wrote step {step} for {sample.name}")
-        # await to unblock? time entire fn.
+    voices = active_voices.get()
+    n = 0
+    try:
+        for i in range(len(voices)):
+            if prepare_voice(step, step_time, voices[i], n, i):
+                n += 1
+            else:
+                active_voices.set_level(voices[i], 0.0)  # silent this step, first to steal
+        if n > 0:
+            dsp_begin = ticks_us()
+            bytes_written = native_wav.mix(audio_out_buffer, n, mix_sources, voice_params, mix_filter_states,
+                                           limiter_state, meter_state)
+            read_meters(n)
+            effects_chain.process(audio_out_buffer, bytes_written)
+            dsp_us = ticks_diff(ticks_us(), dsp_begin)
+            if dsp_us > 10000:
+                logger.warning(f"step {step}: DSP={dsp_us}µs for {n} voices")
+            logger.debug(f"mixed step {step}: {n} voices, {bytes_written} bytes")
+        elif not voices:
+            # nothing playing: the effects still run, over a silent step, so delay and reverb
+            # tails ring out. with voices but none rendered (between stretched slices), the
+            # last mix is still playing and already went through the effects
+            bytes_written = silent_step() if effects_chain.any_on() else 0
+            effects_chain.process(audio_out_buffer, bytes_written)
+    except MemoryError:
+        # the heap is budgeted (see sample.make_resident_arena), but drop a step rather
+        # than the whole app if a chunk read or a voice still can't allocate
+        logger.error(f"step {step}: out of memory, {n} voices mixed, skipping it")
+        bytes_written = 0
+    finally:
+        for k in range(MAX_VOICES):
+            if mix_buffers[k] is not None:
+                voice_buffers.give_back(mix_buffers[k])
+            mix_buffers[k] = mix_sources[k] = mix_samples[k] = None
     elapsed = ticks_diff(ticks_us(), t0) / 1000000
     if elapsed > 0.02:
         logger.warning(f"prepare_step {step} took {elapsed:.4f}s")
+    if step % CACHE_STATS_INTERVAL == 0:
+        chunk_cache.log_stats()
+        file_pool.log_stats()
+        log_limiter_stats()
+        log_meter_stats()
 
-def write_channel(step, step_time, sample, no_mix, voice_index=0):
-    global target_samples, bytes_written, step_start_bytes, planned_step_time
+def silent_step() -> int:
+    """ zero one step's worth of audio_out_buffer at the current bpm
+    :returns its length in bytes
+    """
+    clock = get_running_clock()
+    bpm = internal_clock.bpm if clock is None else clock.bpm
+    nbytes = min(round(60 / bpm / 8 * SAMPLE_RATE_IN_HZ) * BYTES_PER_SAMPLE, len(audio_out_buffer))
+    for start in range(0, nbytes, len(SILENCE)):
+        end = min(start + len(SILENCE), nbytes)
+        audio_out_mv[start:end] = SILENCE[:end - start]
+    return nbytes
+
+def read_meters(n):
+    """ hand each mixed voice's RMS this step to active_voices, for STEAL_QUIETEST,
+    and keep the bus figures for log_meter_stats
+    """
+    global meter_loudest, meter_clipped
+    for k in range(n):
+        active_voices.set_level(mix_samples[k], math.sqrt(meter_state[(1 + k) * native_wav.METER_STATE + 1]))
+    meter_loudest = max(meter_loudest, math.sqrt(meter_state[1]))
+    meter_clipped += int(meter_state[2])
+
+def log_meter_stats():
+    """ log and reset the bus meter telemetry """
+    global meter_loudest, meter_clipped
+    if meter_loudest > 0:
+        logger.info(f"meters: loudest step {20 * math.log10(meter_loudest):.1f}dBFS RMS, {meter_clipped} samples over full scale before the limiter")
+    meter_loudest = 0.0
+    meter_clipped = 0
+
+def log_limiter_stats():
+    """ log and reset the limiter telemetry, gain reduction is how far the gain dipped """
+    min_gain, peak = limiter_state[1], limiter_state[2]
+    if min_gain < 1:
+        logger.info(f"limiter: gain reduction {-20 * math.log10(min_gain):.1f}dB, bus peak {peak * 100:.0f}% of full scale")
+    limiter_state[1] = 1.0
+    limiter_state[2] = 0.0
+
+def snap_bounds(step, chunk, sample, voice_index, direction=1):
+    """ source range native_wav should play of chunk, trimmed to its zero crossings
+    where playback jumps in from, or out to, something other than the next chunk in
+    direction. reversed, the chunk is entered at its tail and left at its head
+    :returns (snap_start, snap_end, dc, jumps_in, jumps_out)
+    """
+    head, tail, dc = sample.chunk_snap(chunk)
+    chunk_samples = sample.chunk_samples(chunk)
+    # stretched slices render every render_interval() steps, the steps between play on
+    continues = (voice_last_sample[voice_index] is sample
+                 and 0 < step - voice_last_step[voice_index] <= fx.render_interval()
+                 and voice_last_direction[voice_index] == direction
+                 and voice_last_chunk[voice_index] == (chunk - direction) % sample.chunks)
+    voice_last_sample[voice_index] = sample
+    voice_last_step[voice_index] = step
+    voice_last_chunk[voice_index] = chunk
+    voice_last_direction[voice_index] = direction
+    next_chunk = fx.next_rendered_chunk(sample, step)
+    next_direction = -1 if fx.reverse_active() else 1
+    continues_next = next_direction == direction and next_chunk == (chunk + direction) % sample.chunks
+    keep_head, keep_tail = (continues, continues_next) if direction > 0 else (continues_next, continues)
+    snap_start = 0 if keep_head else head
+    snap_end = chunk_samples if keep_tail else chunk_samples - tail
+    return snap_start, snap_end, dc, not continues, not continues_next
+
+def prepare_voice(step, step_time, sample, slot, voice_index=0) -> bool:
+    """ read sample's chunk for step and fill mix slot with it and its parameters
+    :returns whether the voice plays this step
+    """
+    global target_samples, planned_step_time
     # logger.info(f"step {step} planned for {step_time}")
     planned_step_time = step_time
     ticks = ticks_us()
@@ -106,46 +245,94 @@ def write_channel(step, step_time, sample, no_mix, voice_index=0):
     log_joystick()
     if params.step is None:
         logger.info(f"skipping step {step} ({params.step})")
-        return
+        return False
     # stretch_block_length = 0.015 # in seconds
     stretch_block_length = control.timestretch_grain_knob.value()
     stretch_block_input_samples = round(SAMPLE_RATE_IN_HZ * stretch_block_length)
-    pitched_samples = round(sample.samples_per_chunk / params.pitch_rate)
+    pitched_samples = round(sample.chunk_samples(params.step) / params.pitch_rate)
     if params.pitch_rate != 1:
         logger.info(f"pitch rate {params.pitch_rate}")
     if stretch_block_input_samples > pitched_samples:
         logger.debug(f"stretch block bigger than sample chunk {stretch_block_input_samples} vs {sample.samples_per_chunk}, using smaller")
         logger.debug(f"stretch block: {stretch_block_length}")
         stretch_block_input_samples = pitched_samples
-    stretch_block_output_samples = round(1 / params.stretch_rate * stretch_block_input_samples)
     # logger.info(f"play rate for step {step} is {rate}")
     effective_rate = params.stretch_rate * params.pitch_rate
+    # output always lasts one step. a transient aligned slice is longer or shorter than
+    # samples_per_chunk, the grains time scale it to fill the step exactly
     target_samples = round(sample.samples_per_chunk / effective_rate)
+    # equal grains, so no short last grain is cut off before the end of the slice, and
+    # grain out rounded up, the voice stops at target_samples
+    grains = -(-pitched_samples // stretch_block_input_samples)
+    stretch_block_input_samples = -(-pitched_samples // grains)
+    stretch_block_output_samples = -(-stretch_block_input_samples * target_samples // pitched_samples)
+    crossfade_samples = round(STRETCH_CROSSFADE * stretch_block_input_samples)
     write_begin = ticks_us()
     logger.debug(f"preamble for {step} took {ticks_diff(write_begin, ticks) / 1000000}s")
 
-    if params.play_step:
-        volume = 0 if control.volume_knob.value() < 0.02 else control.volume_knob.value()
-        mix_depth = 0 if no_mix else 1.0
-        sd_begin = ticks_us()
-        chunk_samples = sample.get_chunk(params.step)
-        sd_us = ticks_diff(ticks_us(), sd_begin)
-        dsp_begin = ticks_us()
-        bytes_written = native_wav.write(audio_out_buffer,
-                                         chunk_samples,
-                                         stretch_block_input_samples,
-                                         stretch_block_output_samples,
-                                         target_samples,
-                                         pitched_samples,
-                                         params.pitch_rate,
-                                         volume,
-                                         control.filter_knob.value(),
-                                         mix_depth,
-                                         filter_states[voice_index])
-        dsp_us = ticks_diff(ticks_us(), dsp_begin)
-        if sd_us > 10000 or dsp_us > 10000:
-            logger.warning(f"step {step}: SD={sd_us}µs DSP={dsp_us}µs")
-        logger.debug(f"finished writing {step} res={bytes_written}, took {ticks_diff(ticks_us(), write_begin) / 1000000}s")
+    if not params.play_step:
+        return False
+    volume = 0 if control.volume_knob.value() < 0.02 else control.volume_knob.value()
+    snap_start, snap_end, dc, jumps_in, jumps_out = snap_bounds(step, params.step % sample.chunks, sample, voice_index, params.direction)
+    params.declick_in = jumps_in or not fx.gate_open(step - 1)
+    params.declick_out = jumps_out or not fx.gate_open(step + 1)
+    # unpitched steps land on whole samples, interpolating would only cost time
+    interp = native_wav.NEAREST if params.pitch_rate == 1 else RESAMPLE_MODE
+    # prepare_step gives it back after the mix, even if get_chunk raises
+    mix_buffers[slot] = voice_buffers.lend()
+    sd_begin = ticks_us()
+    mix_sources[slot] = sample.get_chunk(params.step, mix_buffers[slot])
+    sd_us = ticks_diff(ticks_us(), sd_begin)
+    if sd_us > 10000:
+        logger.warning(f"step {step}: SD={sd_us}µs")
+    mix_filter_states[slot] = filter_states[voice_index]
+    mix_samples[slot] = sample
+    p = voice_params[slot]
+    p[0] = stretch_block_input_samples
+    p[1] = stretch_block_output_samples
+    p[2] = target_samples
+    p[3] = pitched_samples
+    p[4] = params.pitch_rate
+    p[5] = volume
+    p[6] = control.filter_knob.value()
+    p[7] = snap_start
+    p[8] = snap_end
+    p[9] = dc
+    p[10] = interp
+    p[11] = crossfade_samples
+    p[12] = FILTER_MODE
+    p[13] = native_wav.DECLICK_IN * params.declick_in | native_wav.DECLICK_OUT * params.declick_out
+    p[14] = DECLICK_SAMPLES
+    p[15] = params.direction
+    logger.debug(f"prepared {sample.name} for {step}, took {ticks_diff(ticks_us(), write_begin) / 1000000}s")
+    return True
+
+async def read_ahead():
+    """ background task: pre-read the chunks active voices will need into chunk_cache
+    while there is idle time before the next step, so prepare_voice finds them cached.
+    a wrong guess just means prepare_voice reads synchronously as before
+    """
+    prefetched = 0
+    while True:
+        await asyncio.sleep_ms(READ_AHEAD_INTERVAL_MS)
+        if (clock := get_running_clock()) is None or not active_voices.any():
+            continue
+        next_step = clock.song_position + 1
+        # a copy, voices can be removed or stolen during the awaits below
+        for voice in tuple(active_voices.get()):
+            for chunk in fx.predict_chunks(voice, next_step, READ_AHEAD_STEPS):
+                until_step = ticks_diff(clock.predict_next_step_ticks(), ticks_us()) / 1000000
+                if until_step < LOOKAHEAD_SEC + READ_AHEAD_MARGIN_SEC:
+                    break
+                # a voice that stopped has released its file_pool handle, prefetching would
+                # reopen it and could push out the handle of one still playing
+                if voice not in active_voices.get():
+                    break
+                if voice.prefetch(chunk):
+                    prefetched += 1
+                    if prefetched % CACHE_STATS_INTERVAL == 0:
+                        logger.info(f"read ahead {prefetched} chunks")
+                    await asyncio.sleep_ms(0)
 
 def seconds_to_bytes(seconds):
     samples = round(seconds * SAMPLE_RATE_IN_HZ)
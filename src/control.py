@@ -45,6 +45,7 @@ KEY_COLS = [Pin("D9"), Pin("D10"), Pin("D11"), Pin("D12"), Pin("D0")]
 # REDO layout! more fx keys!!
 SAMPLE_KEYS = [0, 1, # 2,
                3, 4, 5, 6, 7]
+REVERSE_KEY = 2
 LATCH_KEYS = [8, 9, 10, 11]
 GATE_KEYS = [12, 13, 14, 15]
 # SNARE_KEY = 12
@@ -196,7 +197,11 @@ def switch_bank():
     global current_bank
     logger.info(f"sample offset set to {current_bank}")
     current_bank = (current_bank + 1) % NBANKS
+    load_current_bank()
     # logger.info(f"sample offset set to {current_bank}")
+
+def load_current_bank():
+    sample.load_bank(current_bank * BANK_SIZE, len(SAMPLE_KEYS))
 rotary_button_2.down_cb = switch_bank
 
 prev_controls = ()
@@ -227,3 +232,4 @@ def init():
                                        range_mode=Rotary.RANGE_BOUNDED,
                                        incr=BANK_SIZE), rotary_button_1)
     rotary2 = RotaryKnob(RotaryIRQ(ROT_CLK, ROT_DT, pull_up=True, reverse=True), rotary_button_2)
+    load_current_bank()
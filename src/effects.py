@@ -0,0 +1,113 @@
+from array import array
+
+import native_fx
+
+from sample import SAMPLE_RATE
+from utility import get_logger
+
+logger = get_logger(__name__)
+
+
+class Effect:
+    """ an insert effect for EffectsChain: its native_fx params, kind, wet, then its own
+    settings, and the state native_fx keeps between steps. starts bypassed (wet 0)
+    """
+    KIND = -1
+
+    def __init__(self, delay_samples: int = 0):
+        self.params = array("f", [0] * native_fx.EFFECT_PARAMS)
+        self.params[0] = self.KIND
+        self.state = bytearray(native_fx.state_size(self.KIND, delay_samples))
+
+    def set_wet(self, wet: float):
+        """ 0 bypasses the effect, 1 is fully wet """
+        self.params[1] = wet
+
+    def is_on(self) -> bool:
+        return self.params[1] > 0
+
+
+class Bitcrush(Effect):
+    KIND = native_fx.BITCRUSH
+
+    def __init__(self):
+        super().__init__()
+        self.set()
+
+    def set(self, bits: float = 8, downsample: float = 1):
+        """ :param downsample: hold each kept sample this many samples, fractions allowed """
+        self.params[2] = bits
+        self.params[3] = downsample
+
+
+class Delay(Effect):
+    KIND = native_fx.DELAY
+
+    def __init__(self, max_seconds: float = 0.25):
+        """ the ring buffer for max_seconds is allocated now, 2 bytes a sample """
+        super().__init__(round(max_seconds * SAMPLE_RATE) + 1)
+        self.set()
+
+    def set(self, seconds: float = 0.125, feedback: float = 0.4, damping: float = 0.3):
+        self.params[2] = round(seconds * SAMPLE_RATE)
+        self.params[3] = feedback
+        self.params[4] = damping
+
+
+class Reverb(Effect):
+    KIND = native_fx.REVERB
+
+    def __init__(self):
+        super().__init__()
+        self.set()
+
+    def set(self, size: float = 0.5, damping: float = 0.5):
+        self.params[2] = size
+        self.params[3] = damping
+
+
+class RingMod(Effect):
+    KIND = native_fx.RINGMOD
+
+    def __init__(self):
+        super().__init__()
+        self.set()
+
+    def set(self, hz: float = 440):
+        self.params[2] = hz
+
+
+class EffectsChain:
+    """ effects run in order over the mixed step by native_fx.process, a tile at a time
+    in one pass over the buffer. params and states are built once, so process() doesn't
+    allocate
+    """
+
+    def __init__(self, effects: list[Effect]):
+        self.effects = effects
+        self.params = [e.params for e in effects]
+        self.states = [e.state for e in effects]
+        size = sum(len(e.state) for e in effects)
+        logger.info(f"effects chain: {len(effects)} effects, {size} bytes of state")
+
+    def any_on(self) -> bool:
+        """ whether an effect is on, so there may be a tail to play out over silence """
+        for e in self.effects:
+            if e.is_on():
+                return True
+        return False
+
+    def process(self, buf, nbytes: int) -> int:
+        """ call for every step rendered, over silence when nothing plays, and also with
+        everything bypassed, so tails ring out and native_fx sees effects going off and
+        clears their history before they come back on
+        :returns effects that ran
+        """
+        return native_fx.process(buf, nbytes, self.params, self.states)
+
+
+bitcrush = Bitcrush()
+ring_mod = RingMod()
+delay = Delay()
+reverb = Reverb()
+effects_chain = EffectsChain([bitcrush, ring_mod, delay, reverb])
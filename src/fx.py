@@ -9,6 +9,8 @@ import random
 
 logger = get_logger(__name__)
 
+STRETCH_RATE = 0.5
+
 
 class Pitch:
     def __init__(self) -> None:
@@ -110,6 +112,14 @@ class Latch:
             self.step = step
         return self.step + (step - self.start_step) % length
 
+    def peek(self, step: int) -> int:
+        """ step that get() would return for step, without advancing the latch """
+        if self.step is None:
+            return step
+        if self.start_step is None:
+            return self.step
+        return self.step + (step - self.start_step) % self.length
+
     def is_active(self):
         return self.step is not None
 
@@ -138,13 +148,19 @@ class Stretch:
         if self.stretch_start is None:
             self.stretch_start = step
             self.stretch_start -= self.stretch_start % 8
-        steps = (step - self.stretch_start) % (nslices / rate)
-        stretched_slice = (self.stretch_start + rate * steps) % nslices
-        if stretched_slice == round(stretched_slice):
+        stretched_slice = self.slice_at(step, rate, nslices)
+        if stretched_slice is not None:
             logger.info(f"stretched slice {stretched_slice}")
+        return stretched_slice
+
+    def slice_at(self, step: int, rate: float, nslices) -> int | None:
+        """ slice get_slice would return for step, without starting a stretch """
+        start = self.stretch_start if self.stretch_start is not None else step - step % 8
+        steps = (step - start) % (nslices / rate)
+        stretched_slice = (start + rate * steps) % nslices
+        if stretched_slice == round(stretched_slice):
             return int(stretched_slice)
-        else:
-            return None
+        return None
 
     def is_active(self):
         return self.stretch_start is not None
@@ -152,6 +168,19 @@ class Stretch:
     def cancel(self):
         self.stretch_start = None
 
+class Reverse:
+    def __init__(self) -> None:
+        self.reversing = False
+
+    def activate(self):
+        self.reversing = True
+
+    def is_active(self):
+        return self.reversing
+
+    def cancel(self):
+        self.reversing = False
+
 class SampleFlip:
     def __init__(self):
         self.flipping = False
@@ -186,6 +215,7 @@ class JoystickMode:
 
 button_latch = Latch()
 button_stretch = Stretch()
+button_reverse = Reverse()
 class GateRepeatMode(JoystickMode):
     def __init__(self):
         self.latch = Latch()
@@ -247,13 +277,15 @@ class GateRepeatMode(JoystickMode):
         # if params.step:
         #     params.play_step = self.gate.is_on(params.step)
         if x < -0.1:
-            rate = 0.5
+            rate = STRETCH_RATE
             params.stretch_rate *= rate
             params.step = self.stretch.get_slice(params.step, rate, params.sample.chunks)
         else:
             self.stretch.cancel()
         if button_stretch.is_active():
-            params.step = button_stretch.get_slice(params.step or 0, 0.5, params.sample.chunks)
+            params.step = button_stretch.get_slice(params.step or 0, STRETCH_RATE, params.sample.chunks)
+        if button_reverse.is_active():
+            params.direction = -1
 
 
 class PitchStretchMode(JoystickMode):
@@ -264,7 +296,7 @@ class PitchStretchMode(JoystickMode):
     def update(self, params: StepParams):
         x, y = joystick.position()
         if x < -0.5:
-            rate = 0.5
+            rate = STRETCH_RATE
             params.stretch_rate *= rate
             params.step = self.stretch.get_slice(params.step, rate, params.sample.chunks)
         else:
@@ -286,3 +318,35 @@ joystick_mode = GateRepeatMode()
 
 def stretch_active():
     return joystick_mode.stretch.is_active() or button_stretch.is_active()
+
+def reverse_active():
+    return button_reverse.is_active()
+
+def gate_open(step: int) -> bool:
+    """ whether play_step lets step through, a held latch button keeps the gate open """
+    return len(button_latch.lengths) > 0 or joystick_mode.gate.is_on(step)
+
+def render_interval() -> int:
+    """ steps from one rendered step to the next, a stretched slice lasts 1 / STRETCH_RATE steps """
+    return round(1 / STRETCH_RATE) if stretch_active() else 1
+
+def next_rendered_chunk(sample, step: int) -> int | None:
+    """ chunk of sample the next step after step that renders is likely to play, see predict_chunks """
+    for chunk in predict_chunks(sample, step + 1, render_interval()):
+        return chunk
+    return None
+
+def predict_chunks(sample, step: int, n: int):
+    """ chunk indices of sample the next n steps from step are likely to play,
+    following the active stretch or latch without changing its state
+    """
+    latch = button_latch if button_latch.is_active() else joystick_mode.latch
+    stretch = button_stretch if button_stretch.is_active() else joystick_mode.stretch
+    for s in range(step, step + n):
+        if stretch.is_active():
+            s = stretch.slice_at(s, STRETCH_RATE, sample.chunks)
+            if s is None:
+                continue
+        elif latch.is_active():
+            s = latch.peek(s)
+        yield s % sample.chunks
@@ -1,13 +1,38 @@
 from typing import Tuple, List
+from array import array
 import utility
+import gc
+import json
 import math
 import os
+import struct
+from time import ticks_ms, ticks_diff, ticks_add
 TEENSY_SAMPLE_DIR = "/flash/samples"
+MANIFEST_NAME = "manifest.json"  # written by scripts/build_manifest.py
+# per chunk slices and snaps of every analyzed sample, read one sample at a time on load
+SLICE_TABLE_NAME = "slices.bin"  # written by scripts/build_manifest.py
+PACKED_EXT = ".brk"  # written by scripts/pack_bank.py
 
 logger = utility.get_logger(__name__)
 
+# the only format native_wav plays, scripts/convert_samples.py converts everything else
+CHANNELS = 1
+BYTES_PER_SAMPLE = 2
+SAMPLE_RATE = 44100
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def check_wav_format(fmt: bytes):
+    """ raise ValueError unless the fmt chunk is mono 16 bit PCM at SAMPLE_RATE """
+    tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        tag = struct.unpack("<H", fmt[24:26])[0]  # first two bytes of the subformat GUID
+    if tag != WAVE_FORMAT_PCM or channels != CHANNELS or rate != SAMPLE_RATE or bits != 8 * BYTES_PER_SAMPLE:
+        raise ValueError(f"unsupported wav format {tag}: {channels} ch, {rate} Hz, {bits} bit")
+
 def find_wav_data(wav_file) -> Tuple[int, int]:
-    """ Parses wav file to locate data chunk where the samples are
+    """ Parses wav file to locate data chunk where the samples are,
+    checking the fmt chunk on the way
     :returns (data_offset, data_length)
     """
     file_buf = bytearray(4)
@@ -20,123 +45,651 @@ def find_wav_data(wav_file) -> Tuple[int, int]:
 
     wav_file.seek(12)
 
+    checked = False
     while True:
-        wav_file.readinto(file_buf)
+        if wav_file.readinto(file_buf) != 4:
+            raise ValueError("no data chunk")
         descriptor = file_buf.decode("ascii")
         wav_file.readinto(file_buf)
         chunk_size = int.from_bytes(file_buf, "little")
         logger.info(f"descriptor {descriptor}: {chunk_size}")
+        if descriptor == "fmt ":
+            check_wav_format(wav_file.read(chunk_size))
+            checked = True
+            wav_file.seek(chunk_size & 1, 1)
+            continue
         if descriptor == "data":
+            if not checked:
+                raise ValueError("no fmt chunk before data")
             data_offset = wav_file.tell()
             data_length = chunk_size
             logger.info(f"wav data offset {data_offset}, length {data_length}")
             return data_offset, data_length
-        wav_file.seek(chunk_size, 1)
+        # chunks are padded to even sizes
+        wav_file.seek(chunk_size + (chunk_size & 1), 1)
 
-# NOTE: could read the fmt chunk to validate these, for now just assume
-CHANNELS = 1
-BYTES_PER_SAMPLE = 2
-SAMPLE_RATE = 44100
 CHUNKS_PER_BEAT = 8
-MAX_CHUNK_SIZE = 44100
+# longest chunk is an 8th of a beat at Sample.BPM_MIN: 44100 * 60 / 90 / 8 samples = 7350 bytes
+MAX_CHUNK_SIZE = 8192
+MAX_VOICES = 6
+# every voice's read ahead for the next READ_AHEAD_STEPS steps (see audio.read_ahead) has to
+# fit at once, or LRU evicts exactly the chunks read_ahead fetched and the cache thrashes
+READ_AHEAD_STEPS = 2
+CHUNK_CACHE_BYTES = MAX_VOICES * READ_AHEAD_STEPS * MAX_CHUNK_SIZE
+# the resident arena takes the heap free at the first bank load, less a headroom measured
+# there: twice what materializing that bank took (a bank switch loads the next bank while
+# samples of the last one still play) plus the garbage allowed between collections, which
+# gc.threshold holds to RESIDENT_GC_THRESHOLD_BYTES
+RESIDENT_GC_THRESHOLD_BYTES = 32 * 1024
+RESIDENT_MIN_BYTES = 16 * 1024  # below this there's no arena, everything streams
+
+
+class ChunkCache:
+    """ LRU cache of sample chunks in RAM, in slots of slot_size bytes preallocated up
+    front, so a miss during playback reuses a slot instead of allocating.
+    keys are ints from chunk_key() so lookups don't allocate
+    """
+    def __init__(self, budget: int, slot_size: int = MAX_CHUNK_SIZE):
+        self.slot_size = slot_size
+        self.slots = [memoryview(bytearray(slot_size)) for _ in range(budget // slot_size)]
+        self.budget = len(self.slots) * slot_size
+        self.free = list(range(len(self.slots)))
+        self.entries = {}  # key -> [chunk view, tick, slot index]
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.entries
+
+    def get(self, key: int) -> memoryview | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        entry[1] = self.tick
+        return entry[0]
+
+    def reserve(self, key: int, n: int) -> memoryview | None:
+        """ take a slot for an n byte chunk under key, evicting the least recently used
+        chunk if none is free
+        :returns the buffer to read the chunk into, or None if n doesn't fit a slot or there are no slots
+        """
+        if n > self.slot_size or not self.slots:
+            return None
+        self.discard(key)
+        slot = self.free.pop() if self.free else self._evict()
+        self.tick += 1
+        buf = self.slots[slot][:n]
+        self.entries[key] = [buf, self.tick, slot]
+        return buf
+
+    def discard(self, key: int):
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.free.append(entry[2])
+
+    def _evict(self) -> int:
+        """ :returns the slot of the least recently used chunk, now unowned """
+        lru_key = None
+        lru_tick = None
+        for key, entry in self.entries.items():
+            if lru_tick is None or entry[1] < lru_tick:
+                lru_key, lru_tick = key, entry[1]
+        self.evictions += 1
+        return self.entries.pop(lru_key)[2]
+
+    def clear(self):
+        self.entries = {}
+        self.free = list(range(len(self.slots)))
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def log_stats(self):
+        logger.info(f"chunk cache: {len(self.entries)}/{len(self.slots)} slots of {self.slot_size} bytes, "
+                    f"hits={self.hits} misses={self.misses} ({self.hit_rate() * 100:.0f}%) evictions={self.evictions}")
+
+def chunk_key(sample_i: int, chunk_i: int) -> int:
+    return sample_i << 16 | chunk_i
+
+chunk_cache = ChunkCache(CHUNK_CACHE_BYTES)
+
+
+class BufferPool:
+    """ preallocated chunk buffers, lent to a voice while it reads and renders a chunk
+    that the cache can't hold. lend() and give_back() don't allocate
+    """
+    def __init__(self, count: int, size: int):
+        self.buffers = [memoryview(bytearray(size)) for _ in range(count)]
+        self.free = list(self.buffers)
+
+    def lend(self) -> memoryview:
+        if not self.free:
+            raise RuntimeError(f"all {len(self.buffers)} chunk buffers are lent out")
+        return self.free.pop()
+
+    def give_back(self, buf: memoryview):
+        self.free.append(buf)
+
+voice_buffers = BufferPool(MAX_VOICES, MAX_CHUNK_SIZE)
+
+
+class FilePool:
+    """ long-lived read handles for playing samples, so a chunk read is just seek + readinto.
+    handles are released when their sample leaves ActiveVoices
+    """
+    WINDOW_MS = 60000
+
+    def __init__(self, size: int):
+        self.size = size
+        self.handles = {}
+        self.opens = 0
+        self.window_start = ticks_ms()
+        self.window_opens = 0
+        self.previous_window_opens = 0
+
+    def get(self, name: str):
+        f = self.handles.get(name)
+        if f is None:
+            if len(self.handles) >= self.size:
+                self.release(next(iter(self.handles)))
+            f = open(name, "rb")
+            self.handles[name] = f
+            self.opens += 1
+            self._roll_window()
+            self.window_opens += 1
+        return f
+
+    def release(self, name: str):
+        f = self.handles.pop(name, None)
+        if f is not None:
+            f.close()
+
+    def close_all(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+
+    def _roll_window(self) -> int:
+        """ start a new window once WINDOW_MS have passed, a window that went by with no
+        calls counts as having no opens
+        :returns ms into the current window
+        """
+        elapsed = ticks_diff(ticks_ms(), self.window_start)
+        if elapsed >= self.WINDOW_MS:
+            self.previous_window_opens = self.window_opens if elapsed < 2 * self.WINDOW_MS else 0
+            self.window_opens = 0
+            elapsed %= self.WINDOW_MS
+            self.window_start = ticks_add(ticks_ms(), -elapsed)
+        return elapsed
+
+    def opens_per_minute(self) -> int:
+        """ opens over the last WINDOW_MS as of now, the current window's plus the share of
+        the previous one still inside the last minute
+        """
+        elapsed = self._roll_window()
+        return round(self.window_opens + self.previous_window_opens * (self.WINDOW_MS - elapsed) / self.WINDOW_MS)
+
+    def log_stats(self):
+        logger.info(f"file pool: {len(self.handles)}/{self.size} open, "
+                    f"{self.opens} opens total, {self.opens_per_minute()}/min")
+
+file_pool = FilePool(MAX_VOICES)
 
 
 class Sample:
     BPM_MIN = 90
     BPM_MAX = 180
 
-    wav_samples = bytearray(MAX_CHUNK_SIZE)
-    wav_samples_mv = memoryview(wav_samples)
+    # set by ResidentArena while the whole sample is held in RAM
+    resident = None
+    resident_offset = None
+    # head, tail, dc per chunk from scripts/analyze_samples.py, see chunk_snap
+    snaps = None
+    NO_SNAP = (0, 0, 0)
+
+    def __init__(self, wav_filename: str, i, meta: tuple | None = None):
+        """ :param meta: the file's manifest fields from scan_samples, skips parsing the wav if given """
+        self.name = wav_filename
+        self.i = i
+        if meta is not None:
+            self.wav_offset, self.wav_size, self.bpm, total_beats, chunk_size, table = meta
+            self.chunks = CHUNKS_PER_BEAT * total_beats
+            self.samples_per_chunk = chunk_size // BYTES_PER_SAMPLE // CHANNELS
+            slices = self._read_slice_table(table) if table >= 0 else None
+            self._init_slices(self.wav_size // BYTES_PER_SAMPLE // CHANNELS, slices)
+            logger.info(f"{wav_filename} from manifest: {self.bpm} bpm, {total_beats} beats")
+        else:
+            self._parse(wav_filename)
+        if self.chunk_size > MAX_CHUNK_SIZE:
+            logger.error(f"chunk_size {self.chunk_size} for {self.name} is bigger than allocated array")
+
+    def _read_slice_table(self, table: int) -> array | None:
+        """ read this sample's slices, and the snaps measured on them, from slices.bin at
+        byte offset table: chunks + 1 uint32 slices then chunks (head, tail, dc) int16
+        :returns the slices, None if they can't be read
+        """
+        slices = array("I", bytes(4 * (self.chunks + 1)))
+        snaps = array("h", bytes(6 * self.chunks))
+        try:
+            with open(f"{self.name.rsplit('/', 1)[0]}/{SLICE_TABLE_NAME}", "rb") as f:
+                f.seek(table)
+                # little endian on disk and on the teensy, so read straight into the arrays
+                if f.readinto(slices) != len(slices) * 4 or f.readinto(snaps) != len(snaps) * 2:
+                    raise OSError("slice table truncated")
+        except OSError as e:
+            logger.warning(f"no slices for {self.name}, using equal chunks: {e}")
+            return None
+        self.snaps = snaps
+        return slices
 
-    def __init__(self, wav_filename: str, i):
+    def _parse(self, wav_filename):
         logger.info(wav_filename)
         with open(wav_filename, "rb") as wav_file:
             self.wav_offset, self.wav_size = find_wav_data(wav_file)
-        self.name = wav_filename
-        self.i = i
 
         nsamples = self.wav_size / CHANNELS / BYTES_PER_SAMPLE
         length = nsamples / SAMPLE_RATE
 
+        # same rule as guess_beats in scripts/build_manifest.py: double the beat count until
+        # bpm reaches BPM_MIN. a sample too short for 2 beats at BPM_MAX keeps the 2 beat
+        # guess above BPM_MAX, doubling would only take it further out of range
         total_beats = 2
         while True:
             self.bpm = round(total_beats / length * 60, 2)
             logger.info(f"self.bpm is {self.bpm}")
-            if self.bpm >= Sample.BPM_MIN and self.bpm <= Sample.BPM_MAX:
+            if self.bpm >= Sample.BPM_MIN:
                 logger.info(f"calculated bpm assuming {total_beats} is {self.bpm} for {wav_filename}")
                 break
             total_beats *= 2
+        if self.bpm > Sample.BPM_MAX:
+            logger.warning(f"{wav_filename} is too short for {Sample.BPM_MAX} bpm, playing it at {self.bpm}")
 
         # can rounding cause trouble here? ie compounding offset, could do it in get_chunk instead
         self.chunks = CHUNKS_PER_BEAT * total_beats
         self.samples_per_chunk = math.ceil(nsamples / self.chunks)
-        self.chunk_size = self.samples_per_chunk * BYTES_PER_SAMPLE * CHANNELS
+        self._init_slices(int(nsamples))
         logger.info(f"{wav_filename} is {length:.3f}s")
 
 
         logger.info(f"{nsamples} total samples, {self.chunk_size} bytes per chunk")
+
+    def _init_slices(self, nsamples: int, slices: List[int] | None = None) -> bool:
+        """ self.slices[i] is the first sample of chunk i, ending with nsamples.
+        scripts/analyze_samples.py can move the boundaries onto transients,
+        otherwise every chunk but the tail is samples_per_chunk long
+        :returns whether the given slices were used
+        """
+        analyzed = slices is not None and len(slices) == self.chunks + 1
+        if not analyzed:
+            slices = [min(i * self.samples_per_chunk, nsamples) for i in range(self.chunks + 1)]
+        self.slices = array("I", slices)
+        longest = max(self.slices[i + 1] - self.slices[i] for i in range(self.chunks))
+        self.chunk_size = longest * BYTES_PER_SAMPLE * CHANNELS
+        return analyzed
+
+    def chunk_snap(self, i: int) -> Tuple[int, int, int]:
+        """ :returns (head, tail, dc) of the ith chunk: samples before its first and after
+        its last zero crossing, and its mean. NO_SNAP if the sample wasn't analyzed
+        """
+        if self.snaps is None:
+            return self.NO_SNAP
+        i = i % self.chunks * 3
+        return self.snaps[i], self.snaps[i + 1], self.snaps[i + 2]
+
+    def chunk_samples(self, i: int) -> int:
+        """ length of the ith chunk in samples, which varies with transient aligned slices """
+        i %= self.chunks
+        return self.slices[i + 1] - self.slices[i]
+
+    def get_chunk(self, i: int, buf: memoryview) -> memoryview:
+        """ return the ith chunk of the wav file, from chunk_cache if possible
+        :param buf: lent from voice_buffers, used if the chunk can't be cached
+        """
+        i %= self.chunks
+        if self.resident is not None:
+            start = self.chunk_offset(i) - self.chunk_offset(0)
+            return self.resident[start:start + self.chunk_size]
+        key = chunk_key(self.i, i)
+        if (cached := chunk_cache.get(key)) is not None:
+            return cached
+        if (dest := chunk_cache.reserve(key, self.chunk_size)) is None:
+            dest = buf
+        self._read_chunk(i, key, dest)
+        return dest
+
+    def chunk_offset(self, i: int) -> int:
+        return self.wav_offset + self.slices[i] * BYTES_PER_SAMPLE * CHANNELS
+
+    def chunk_bytes(self, i: int) -> int:
+        """ bytes to read for the ith chunk, never past the end of the data chunk """
+        return (self.slices[i + 1] - self.slices[i]) * BYTES_PER_SAMPLE * CHANNELS
+
+    def prefetch(self, i: int) -> bool:
+        """ read the ith chunk into chunk_cache ahead of time
+        :returns whether a read was needed
+        """
+        i %= self.chunks
+        key = chunk_key(self.i, i)
+        if self.resident is not None or key in chunk_cache or (dest := chunk_cache.reserve(key, self.chunk_size)) is None:
+            return False
+        self._read_chunk(i, key, dest)
+        return True
+
+    def resident_size(self) -> int:
+        """ bytes needed to hold every chunk, with room for a full chunk_size read of the tail """
+        return self.chunk_offset(self.chunks - 1) - self.chunk_offset(0) + self.chunk_size
+
+    def load_resident(self, dest: memoryview):
+        """ read all chunks into dest in one go, see ResidentArena """
+        last = self.chunks - 1
+        with open(self.name, "rb") as f:
+            f.seek(self.chunk_offset(0))
+            n = f.readinto(dest, self.chunk_offset(last) - self.chunk_offset(0) + self.chunk_bytes(last))
+        dest[n:] = bytes(len(dest) - n)
+        self.resident = dest
+
+    def _read_chunk(self, i: int, key: int, dest: memoryview):
+        """ read exactly the ith chunk into dest, zero filling the rest of chunk_size after the tail """
+        wav_file = file_pool.get(self.name)
+        try:
+            wav_file.seek(self.chunk_offset(i))
+            # logger.info(f"reading offset {offset}")
+            n = wav_file.readinto(dest, self.chunk_bytes(i))
+        except OSError:
+            chunk_cache.discard(key)
+            raise
+        if n < self.chunk_size:
+            dest[n:self.chunk_size] = bytes(self.chunk_size - n)
+        # logger.info(f"samples array {dest[:64]}")
+
+class PackedSample(Sample):
+    """ sample packed by scripts/pack_bank.py. every chunk starts on a sector boundary
+    and is padded to whole sectors, so a step is exactly one aligned read.
+    layout: header, chunk table of (byte offset, samples) uint32 pairs, version 2 adds
+    a (head, tail, dc) int16 snap table, then sector aligned chunks
+    """
+    MAGIC = b"BRKB"
+    VERSION = 2
+    HEADER = "<4sHHfHHI"  # magic, version, sector size, bpm, beats, chunks, nominal samples per chunk
+
+    def __init__(self, filename: str, i, meta: dict | None = None):
+        self.name = filename
+        self.i = i
+        with open(filename, "rb") as f:
+            header = f.read(struct.calcsize(self.HEADER))
+            magic, version, self.sector_size, bpm, total_beats, self.chunks, self.samples_per_chunk = \
+                struct.unpack(self.HEADER, header)
+            if magic != self.MAGIC or not 1 <= version <= self.VERSION:
+                raise ValueError(f"{filename} is not a version 1-{self.VERSION} packed sample")
+            # little endian on disk and on the teensy, so read the tables straight into the arrays
+            self.table = array("I", bytes(8 * self.chunks))
+            f.readinto(self.table)
+            if version >= 2:
+                self.snaps = array("h", bytes(6 * self.chunks))
+                f.readinto(self.snaps)
+        self.bpm = round(bpm, 2)
+        longest = max(self.table[2 * c + 1] for c in range(self.chunks))
+        chunk_bytes = longest * BYTES_PER_SAMPLE * CHANNELS
+        self.chunk_size = (chunk_bytes + self.sector_size - 1) // self.sector_size * self.sector_size
+        logger.info(f"{filename} packed: {self.bpm} bpm, {total_beats} beats, {self.chunk_size} byte reads")
         if self.chunk_size > MAX_CHUNK_SIZE:
             logger.error(f"chunk_size {self.chunk_size} for {self.name} is bigger than allocated array")
 
+    def chunk_offset(self, i: int) -> int:
+        return self.table[2 * i]
 
-    def get_chunk(self, i: int) -> memoryview:
-        with open(self.name, "rb") as wav_file:
-            """ read the ith chunk of wav file into memory and return it """
-            wav_file.seek(self.wav_offset + i % self.chunks * self.chunk_size)
-            # logger.info(f"reading offset {offset}")
-            wav_file.readinto(self.wav_samples_mv)
-            # logger.info(f"samples array {self.wav_samples[:64]}")
-        return self.wav_samples_mv
+    def chunk_samples(self, i: int) -> int:
+        return self.table[2 * (i % self.chunks) + 1]
 
-def load_samples(folder: str) -> List[Sample]:
-    files = sorted(os.listdir(folder))
-    return [Sample(f"{folder}/{wav}", i) for i, wav in enumerate(files) if ".wav" in wav]
+    def chunk_bytes(self, i: int) -> int:
+        n = self.table[2 * i + 1] * BYTES_PER_SAMPLE * CHANNELS
+        return (n + self.sector_size - 1) // self.sector_size * self.sector_size
+
+class ResidentArena:
+    """ one preallocated buffer holding whole samples of the current bank, so their
+    chunks are memoryview slices with no I/O. filled in bank order at bank load,
+    samples that don't fit in what's left keep streaming through chunk_cache
+    """
+    def __init__(self, size: int):
+        self.buf = memoryview(bytearray(size))
+        self.samples = []
+
+    def assign(self, samples: List[Sample]):
+        for s in self.samples:
+            if s not in samples:
+                s.resident = s.resident_offset = None
+        self.samples = []
+        used = 0
+        for s in samples:
+            n = s.resident_size()
+            if used + n > len(self.buf):
+                if s.resident is not None:
+                    s.resident = s.resident_offset = None
+                logger.info(f"streaming {s.name}: {n} bytes, {len(self.buf) - used} left in resident budget")
+                continue
+            if s.resident is None or s.resident_offset != used:
+                s.load_resident(self.buf[used:used + n])
+                s.resident_offset = used
+            self.samples.append(s)
+            used += n
+            logger.info(f"resident {s.name}: {n} bytes")
+        logger.info(f"{len(self.samples)}/{len(samples)} samples resident, {used}/{len(self.buf)} bytes")
+
+class SampleStub:
+    """ metadata-only placeholder for every file in the library,
+    only the loaded bank is materialized into Sample objects
+    """
+    def __init__(self, name: str, i: int, meta: tuple | None):
+        self.name = name
+        self.i = i
+        self.meta = meta  # (offset, length, bpm, beats, chunk_size, slice table offset or -1)
+
+    def load(self) -> Sample:
+        if self.name.endswith(PACKED_EXT):
+            return PackedSample(self.name, self.i)
+        return Sample(self.name, self.i, self.meta)
+
+def load_manifest(folder: str) -> dict:
+    """ sample metadata precomputed on the host, keyed by file name """
+    try:
+        with open(f"{folder}/{MANIFEST_NAME}") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"no usable manifest in {folder}, parsing every sample: {e}")
+        return {}
+    return manifest.get("samples", {})
+
+def scan_samples(folder: str) -> List[SampleStub]:
+    manifest = load_manifest(folder)
+    # ilistdir gives file sizes without a stat per file
+    files = sorted((entry[0], entry[3]) for entry in os.ilistdir(folder)
+                   if entry[0].endswith(".wav") or entry[0].endswith(PACKED_EXT))
+    stubs = []
+    stale = 0
+    for wav, size in files:
+        meta = manifest.get(wav)
+        if meta is not None and meta["size"] != size:
+            meta = None
+        if meta is not None:
+            # only the fixed size fields, slices and snaps stay on flash until load()
+            meta = (meta["offset"], meta["length"], meta["bpm"], meta["beats"], meta["chunk_size"], meta.get("table", -1))
+        if meta is None and not wav.endswith(PACKED_EXT):
+            stale += 1
+            # the manifest only lists playable files, check the rest before they get a key
+            try:
+                with open(f"{folder}/{wav}", "rb") as f:
+                    find_wav_data(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"skipping {wav}: {e}, run scripts/convert_samples.py")
+                continue
+        stubs.append(SampleStub(f"{folder}/{wav}", len(stubs), meta))
+    if stale:
+        logger.warning(f"{stale} samples missing or changed since the manifest was built, they will be parsed on load with a guessed tempo")
+    return stubs
+
+STEAL_OLDEST = 0  # replace the voice that started first
+STEAL_QUIETEST = 1  # replace the voice with the lowest level from set_level
+STEAL_SAME_SAMPLE = 2  # replace a voice already playing the same sample, else the oldest
 
 class ActiveVoices:
-    FREE = (None, None)
-    voices = [FREE] * 6
+    """ fixed table of MAX_VOICES slots, one per held key. get() returns a list of
+    the distinct samples playing that is kept up to date on add/remove, so the
+    per step callers don't allocate. when all slots are taken, add() steals one
+    according to steal_policy
+    """
+    NO_KEY = -1
+
+    def __init__(self, steal_policy: int = STEAL_OLDEST):
+        self.steal_policy = steal_policy
+        self.slot_samples = [None] * MAX_VOICES
+        self.keys = array("i", [self.NO_KEY] * MAX_VOICES)
+        self.started = array("I", [0] * MAX_VOICES)  # add() order, for STEAL_OLDEST
+        self.levels = array("f", [0] * MAX_VOICES)  # last mixed RMS from audio.read_meters, for STEAL_QUIETEST
+        self.count = 0  # occupied slots
+        self.playing = []  # distinct samples in occupied slots, in order of first add
+        self.next_start = 0
+        self.steals = 0
 
     def add(self, sample, key):
-        # i = 0
-        for i, s in enumerate(self.voices):
-            if s == self.FREE:
-                break
-        self.voices[i] = (sample, key)
+        i = self._find(key)
+        if i < 0:
+            i = self._find(self.NO_KEY)
+        if i < 0:
+            i = self._steal(sample)
+            self.steals += 1
+            logger.info(f"all {MAX_VOICES} voices busy, replacing voice {i} ({self.slot_samples[i].name})")
+        if self.keys[i] != self.NO_KEY:
+            self._clear(i)
+        self.slot_samples[i] = sample
+        self.keys[i] = key
+        self.next_start += 1
+        self.started[i] = self.next_start
+        # full scale until its first mix is metered, a voice that hasn't sounded yet is
+        # never the quietest, else STEAL_QUIETEST would take the newest hit every time
+        self.levels[i] = 1.0
+        self.count += 1
+        if sample not in self.playing:
+            self.playing.append(sample)
         logger.info(f"added {sample.name, key} as voice {i}")
 
     def remove(self, key):
-        for i, pair in enumerate(self.voices):
-            sample, k = pair
-            if key == k:
-                self.voices[i] = self.FREE
-                logger.info(f"removed {sample.name, key} from voice {i}")
+        for i in range(MAX_VOICES):
+            if self.keys[i] == key:
+                logger.info(f"removed {self.slot_samples[i].name, key} from voice {i}")
+                self._clear(i)
+
+    def _clear(self, i):
+        sample = self.slot_samples[i]
+        self.slot_samples[i] = None
+        self.keys[i] = self.NO_KEY
+        self.count -= 1
+        if sample not in self.slot_samples:
+            self.playing.remove(sample)
+            file_pool.release(sample.name)
+
+    def _find(self, key) -> int:
+        for i in range(MAX_VOICES):
+            if self.keys[i] == key:
+                return i
+        return -1
+
+    def _steal(self, sample) -> int:
+        """ :returns the slot to replace, only called with every slot occupied """
+        if self.steal_policy == STEAL_SAME_SAMPLE:
+            for i in range(MAX_VOICES):
+                if self.slot_samples[i] is sample:
+                    return i
+        rank = self.levels if self.steal_policy == STEAL_QUIETEST else self.started
+        victim = 0
+        for i in range(1, MAX_VOICES):
+            if rank[i] < rank[victim]:
+                victim = i
+        return victim
 
-    def get(self):
-        on_voices = set([sample for sample, _ in self.voices if sample is not None])
-        # logger.info(f"active voices: {on_voices}")
-        return on_voices
+    def set_level(self, sample, level: float):
+        """ record the output level of a playing sample for STEAL_QUIETEST """
+        for i in range(MAX_VOICES):
+            if self.slot_samples[i] is sample:
+                self.levels[i] = level
+
+    def get(self) -> list:
+        """ distinct samples playing. the list is owned by ActiveVoices, don't modify it """
+        return self.playing
 
     def any(self):
-        return len(self.get()) > 0
+        return self.count > 0
 
-samples = []
+samples: List[SampleStub] = []
+loaded = {}  # sample index -> Sample, for the current bank and anything playing
+resident_arena = None
 offset404 = 0
 active_voices = ActiveVoices()
 current_sample = 0
 def init():
     global samples, samples404, offset404
-    samples404 = [] # load_samples("/sd/samples/404")
-    samples = load_samples(TEENSY_SAMPLE_DIR) + samples404
+    samples404 = [] # scan_samples("/sd/samples/404")
+    samples = scan_samples(TEENSY_SAMPLE_DIR) + samples404
     offset404 = len(samples) - len(samples404)
 
-    # samples = load_samples("/sd/samples/ESSENTIAL DRUM BREAKS")
-    logger.info(f"loaded {len(samples)} samples, offset404 {offset404}")
+    # samples = scan_samples("/sd/samples/ESSENTIAL DRUM BREAKS")
+    logger.info(f"found {len(samples)} samples, offset404 {offset404}")
 
 def get_samples():
     return samples
 
+def get_sample(i) -> Sample:
+    """ the ith sample of the library, materialized on first use """
+    i %= len(samples)
+    if (s := loaded.get(i)) is None:
+        s = loaded[i] = samples[i].load()
+    return s
+
+def load_bank(first: int, count: int):
+    """ materialize samples first..first+count and drop other loaded samples that aren't playing """
+    wanted = [i % len(samples) for i in range(first, first + count)]
+    playing = active_voices.get()
+    for i in list(loaded):
+        if i not in wanted and loaded[i] not in playing and i != current_sample:
+            del loaded[i]
+    if resident_arena is None:
+        gc.collect()
+        free_before_bank = gc.mem_free()
+    bank = [get_sample(i) for i in wanted]
+    logger.info(f"loaded bank {wanted}, {len(loaded)} samples in memory")
+    if resident_arena is None:
+        gc.collect()
+        make_resident_arena(free_before_bank - gc.mem_free())
+    resident_arena.assign(bank)
+
+def make_resident_arena(bank_bytes: int):
+    """ size the arena from the heap free at the first bank load, once everything else
+    (chunk_cache slots, voice buffers, display, effects) is allocated, halving on
+    MemoryError since free heap needn't be one contiguous block. sized once and kept,
+    reallocating per bank would fragment the heap
+    :param bank_bytes: heap the first bank took to materialize
+    """
+    global resident_arena
+    gc.threshold(RESIDENT_GC_THRESHOLD_BYTES)
+    headroom = 2 * bank_bytes + RESIDENT_GC_THRESHOLD_BYTES
+    size = gc.mem_free() - headroom
+    while size >= RESIDENT_MIN_BYTES:
+        try:
+            resident_arena = ResidentArena(size)
+            break
+        except MemoryError:
+            size //= 2
+    if resident_arena is None:
+        size = 0
+        resident_arena = ResidentArena(0)
+    logger.info(f"resident arena {size} bytes, headroom {headroom} ({bank_bytes} per bank), {gc.mem_free()} heap free")
+
 def get_current_sample():
-    return samples[current_sample % len(samples)]
+    return get_sample(current_sample)
 
 def set_current_sample(i):
     global current_sample
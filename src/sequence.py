@@ -8,7 +8,12 @@ class StepParams:
         self.step = step
         self.pitch_rate = pitch_rate
         self.stretch_rate = stretch_rate
+        # 1 plays the chunk forwards, -1 backwards (native_wav reads it mirrored, no copy)
+        self.direction = 1
         self.play_step = True
+        # ramp the step in / out in native_wav, where it starts from or stops into silence or a jump
+        self.declick_in = False
+        self.declick_out = False
         self.sample: Sample = sample
 
     def modulate(self, joystick_mode):
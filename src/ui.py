@@ -127,12 +127,21 @@ class LatchUp(ButtonUp):
 
 class SlowDown(ButtonDown):
     def action(self):
-        fx.button_stretch.get_slice(get_current_step(), 0.5, get_current_sample().chunks)
+        fx.button_stretch.get_slice(get_current_step(), fx.STRETCH_RATE, get_current_sample().chunks)
 
 class SlowUp(ButtonUp):
     def action(self):
         fx.button_stretch.cancel()
 
+class ReverseDown(ButtonDown):
+    def action(self):
+        logger.info(f"reversing steps")
+        fx.button_reverse.activate()
+
+class ReverseUp(ButtonUp):
+    def action(self):
+        fx.button_reverse.cancel()
+
 class FlipDown(ButtonDown):
     def action(self):
         logger.info(f"activated sample flip")
@@ -231,3 +240,4 @@ def init():
     control.keypad.on(control.HOLD_KEY, hold_down, hold_up)
     control.keypad.on(control.SLOW_KEY, SlowDown(), SlowUp())
     control.keypad.on(control.FLIP_KEY, FlipDown(), FlipUp())
+    control.keypad.on(control.REVERSE_KEY, ReverseDown(), ReverseUp())
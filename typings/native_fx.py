@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+from typing import Any
+
+BITCRUSH: int
+DELAY: int
+REVERB: int
+RINGMOD: int
+EFFECT_PARAMS: int
+
+def process(*args, **kwargs) -> Any:
+        ...
+
+def state_size(*args, **kwargs) -> Any:
+        ...
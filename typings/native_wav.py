@@ -1,5 +1,34 @@
 #!/usr/bin/env python3
 from typing import Any
 
+NEAREST: int
+LINEAR: int
+HERMITE: int
+VOICE_PARAMS: int
+LIMITER_STATE: int
+METER_STATE: int
+FILTER_STATE: int
+FILTER_FLOAT: int
+FILTER_FIXED: int
+DEFAULT_FILTER_MODE: int
+DECLICK_IN: int
+DECLICK_OUT: int
+SIMD: bool
+
 def write(*args, **kwargs) -> Any:
         ...
+
+def mix(*args, **kwargs) -> Any:
+        ...
+
+def gain(*args, **kwargs) -> Any:
+        ...
+
+def scale(*args, **kwargs) -> Any:
+        ...
+
+def add(*args, **kwargs) -> Any:
+        ...
+
+def saturate(*args, **kwargs) -> Any:
+        ...